@@ -0,0 +1,219 @@
+"""Benchmarks of the FeynmanLogic rendering hot paths.
+
+Runs headless (inkex only, no Inkscape) on synthetic documents and geometries, with a local
+stand-in for pyfeyngen so that the results do not depend on its layout engine. Reports, for
+each size, the time, throughput and peak memory of every phase and the size of the output SVG
+as JSON, to be compared across commits:
+
+    python benchmarks/bench_feynman.py --sizes 10 100 1000 10000 -o bench.json
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inkex
+from feynman_logic import FeynmanStyle
+from feynman_headless import make_extension
+
+EDGE_TYPES = ['fermion', 'photon', 'gluon', 'scalar']
+LABELS = ['p_1', 'k', '\\gamma', '']
+
+def synthetic_geometry(n_edges, seed=0):
+    """Return pyfeyngen-like geometry with n_edges edges between random nodes of a grid,
+        mixing particle types, labels, anti-particles, curved edges and blob vertices."""
+    rng = random.Random(seed)
+    n_nodes = max(2, int(n_edges ** 0.5) * 2)
+    columns = max(1, int(n_nodes ** 0.5))
+    nodes = {}
+    for i in range(n_nodes):
+        row, col = divmod(i, columns)
+        nodes[f"v{i}"] = {'x': col * 150, 'y': row * 100, 'style': 'blob' if rng.random() < 0.1 else 'default'}
+    edges = []
+    for i in range(n_edges):
+        a, b = rng.sample(range(n_nodes), 2)
+        start, end = nodes[f"v{a}"], nodes[f"v{b}"]
+        edges.append({
+            'start_node': f"v{a}", 'end_node': f"v{b}",
+            'start': (start['x'], start['y']), 'end': (end['x'], end['y']),
+            'type': EDGE_TYPES[i % len(EDGE_TYPES)],
+            'label': LABELS[i % len(LABELS)],
+            'is_anti': rng.random() < 0.5,
+            'bend': rng.choice([0.0, 0.0, 0.2, -0.2]),
+        })
+    return {'nodes': nodes, 'edges': edges}
+
+def install_pyfeyngen_stand_in():
+    """Replace pyfeyngen by a module whose quick_geometry("synthetic:N") returns synthetic_geometry(N)."""
+    module = types.ModuleType('pyfeyngen')
+    module.__version__ = 'benchmark'
+    module.quick_geometry = lambda syntax, x_spacing=150, y_spacing=100: synthetic_geometry(int(syntax.split(':')[1]))
+    sys.modules['pyfeyngen'] = module
+
+def builder_styles():
+    """Builder settings cycled over the selected paths."""
+    return [
+        FeynmanStyle(p_type="fermion", arrow_type="right", v_style="dot"),
+        FeynmanStyle(p_type="photon", momentum_arrow="up", momentum_label="k", v_style="blob", v_location="left"),
+        FeynmanStyle(p_type="gluon", momentum_label="p_1", label_latex=True),
+        FeynmanStyle(p_type="scalar", arrow_type="backward", momentum_arrow="forward", v_style="square"),
+    ]
+
+def builder_document(n_paths, seed=0):
+    """Return an extension on a document holding n_paths multi-segment paths, nested in transformed groups."""
+    rng = random.Random(seed)
+    ext = make_extension(['--gen_cache=false'])
+    layer = inkex.Layer.new('Layer 1')
+    ext.svg.add(layer)
+    parent, groups = layer, []
+    for depth in range(3):
+        group = inkex.Group()
+        group.transform = inkex.Transform(translate=(10 * depth, 5 * depth), scale=1.1)
+        parent.add(group)
+        parent = group
+        groups.append(group)
+    paths = []
+    for i in range(n_paths):
+        x, y = rng.uniform(0, 2000), rng.uniform(0, 2000)
+        path = inkex.PathElement()
+        path.set('id', f"bench{i}")
+        path.set('d', f"M {x},{y} C {x + 20},{y - 30} {x + 40},{y + 30} {x + 60},{y} L {x + 90},{y + 15}")
+        path.style = {'stroke': 'black', 'fill': 'none'}
+        groups[i % len(groups)].add(path)
+        paths.append(path)
+    ext.index_document()
+    return ext, paths
+
+def measure(function):
+    """Run function and return (result, seconds)."""
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+def peak_memory(setup):
+    """Return the peak memory (bytes) allocated by the function returned by setup().
+        Measured on its own run, as tracing slows Python down."""
+    function = setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def phase(name, count, elapsed, peak=None, **extra):
+    """Return the report of a benchmark phase."""
+    report = {'phase': name, 'count': count, 'seconds': round(elapsed, 6),
+              'per_second': round(count / elapsed, 1) if elapsed > 0 else None}
+    if peak is not None:
+        report['peak_memory_bytes'] = peak
+    report.update(extra)
+    return report
+
+def bench_generate(n_edges, memory):
+    """Time the generation of a synthetic diagram, and its serialization."""
+    def setup():
+        ext = make_extension(['--gen_cache=false'])
+        ext.index_document()
+        data = synthetic_geometry(n_edges)
+        return lambda: ext.generate_diagram(data)
+
+    ext = make_extension(['--gen_cache=false'])
+    ext.index_document()
+    data = synthetic_geometry(n_edges)
+    _, elapsed = measure(lambda: ext.generate_diagram(data))
+    svg, serialize = measure(ext.svg.tostring)
+    results = [phase('generate_diagram', n_edges, elapsed, peak_memory(setup) if memory else None),
+               phase('serialize', n_edges, serialize, svg_bytes=len(svg))]
+
+    ext = make_extension([f'--gen_syntax=synthetic:{n_edges}', '--gen_cache=false'])
+    _, elapsed = measure(ext.effect)
+    results.append(phase('effect_generate', n_edges, elapsed))
+    return results
+
+def bench_builder(n_paths, memory):
+    """Time the Builder loop on a selection, a second unchanged run, ghost removal and the ensure_* helpers."""
+    styles = builder_styles()
+
+    def setup():
+        ext, paths = builder_document(n_paths)
+        return lambda: [ext.style_path(path, styles[i % len(styles)]) for i, path in enumerate(paths)]
+
+    ext, paths = builder_document(n_paths)
+    run = lambda: [ext.style_path(path, styles[i % len(styles)]) for i, path in enumerate(paths)]
+    _, elapsed = measure(run)
+    results = [phase('builder', n_paths, elapsed, peak_memory(setup) if memory else None,
+                     svg_bytes=len(ext.svg.tostring()))]
+    _, elapsed = measure(run)
+    results.append(phase('builder_unchanged', n_paths, elapsed))
+
+    calls = max(1000, n_paths)
+    style = styles[1]._replace(arrow_type="forward", momentum_arrow="forward")
+    helpers = {
+        'ensure_pattern': lambda: ext.ensure_pattern("photon"),
+        'ensure_vertex_symbol': lambda: ext.ensure_vertex_symbol(style),
+        'ensure_arrow_marker': lambda: ext.ensure_arrow_marker(style),
+        'ensure_lpe': lambda: ext.ensure_lpe("fref_photon", style.amplitude, 0),
+    }
+    for name, helper in helpers.items():
+        _, elapsed = measure(lambda: [helper() for _ in range(calls)])
+        results.append(phase(name, calls, elapsed))
+
+    _, elapsed = measure(lambda: [ext.remove_linked_ghost(path) for path in paths])
+    results.append(phase('remove_linked_ghost', n_paths, elapsed))
+    return results
+
+def git_revision():
+    """Return the current commit of the repository, if known."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="Number of edges / selected paths")
+    parser.add_argument("--repeat", type=int, default=1, help="Keep the fastest of N runs of each size")
+    parser.add_argument("--no-memory", action="store_true", help="Do not trace the peak memory")
+    parser.add_argument("-o", "--output", help="JSON report file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    install_pyfeyngen_stand_in()
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'inkex': getattr(inkex, '__version__', None),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': [],
+    }
+    for size in args.sizes:
+        best = None
+        for _ in range(args.repeat):
+            runs = bench_generate(size, not args.no_memory) + bench_builder(size, not args.no_memory)
+            if best is None:
+                best = runs
+            else:
+                best = [min(a, b, key=lambda r: r['seconds']) for a, b in zip(best, runs)]
+        for result in best:
+            result['size'] = size
+        report['results'] += best
+        print(f"{size} edges done", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
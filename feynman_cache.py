@@ -0,0 +1,80 @@
+"""On-disk cache of the pyfeyngen layouts, so a reaction generated again skips the layout step.
+
+Entries are keyed by (normalized syntax, x spacing, y spacing, pyfeyngen version) and stored as
+compressed JSON in a SQLite file. When the file grows over its size limit, the least recently
+used layouts are removed.
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+
+def default_path():
+    """Return the cache file location ($PYINKFEYN_CACHE_DIR, or the user cache folder)."""
+    folder = os.environ.get('PYINKFEYN_CACHE_DIR')
+    if not folder:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        folder = os.path.join(base, 'pyinkfeyn')
+    return os.path.join(folder, 'layouts.sqlite')
+
+class LayoutCache:
+    """Size-bounded LRU cache of pyfeyngen.quick_geometry results."""
+
+    def __init__(self, path=None, max_bytes=20 * 1024 * 1024):
+        self.path = path or default_path()
+        self.max_bytes = max_bytes
+        self.db = None
+
+    def connect(self):
+        """Open (and create if needed) the cache file."""
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, timeout=10)
+            # A lost entry only costs a new layout: no need to wait for the disk
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = OFF")
+            with self.db:
+                self.db.execute("CREATE TABLE IF NOT EXISTS layouts "
+                                "(key TEXT PRIMARY KEY, data BLOB, size INTEGER, used REAL)")
+        return self.db
+
+    @staticmethod
+    def key(syntax : str, x_spacing, y_spacing, version : str):
+        """Return the cache key of a layout. Whitespace in the syntax is not significant."""
+        return json.dumps([' '.join(syntax.split()), x_spacing, y_spacing, version])
+
+    def get(self, key : str):
+        """Return the cached layout for key, or None."""
+        db = self.connect()
+        row = db.execute("SELECT data FROM layouts WHERE key = ?", (key,)).fetchone()
+        if row is None: return None
+        with db:
+            db.execute("UPDATE layouts SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key : str, data):
+        """Store a layout, then evict the least recently used ones if the cache is too large."""
+        blob = zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        db = self.connect()
+        with db:
+            db.execute("INSERT OR REPLACE INTO layouts VALUES (?, ?, ?, ?)", (key, blob, len(blob), time.time()))
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used layouts until the cache fits in max_bytes."""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM layouts").fetchone()[0]
+        if total <= self.max_bytes: return
+        stale = []
+        for key, size in self.db.execute("SELECT key, size FROM layouts ORDER BY used"):
+            if total <= self.max_bytes: break
+            stale.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM layouts WHERE key = ?", stale)
+
+    def clear(self):
+        """Remove every cached layout."""
+        db = self.connect()
+        with db:
+            db.execute("DELETE FROM layouts")
+        db.execute("VACUUM")
@@ -0,0 +1,15 @@
+"""Script called by Inkscape: runs the extension in the warm worker (feynman_worker.py) if one
+is running, and in this process otherwise. Only imports the standard library before knowing."""
+import sys
+from feynman_worker import forward
+
+if __name__ == '__main__':
+    answer = forward(sys.argv[1:])
+    if answer is None:
+        from feynman_logic import FeynmanLogic
+        FeynmanLogic().run()
+    else:
+        status, stderr, output = answer
+        sys.stderr.write(stderr)
+        sys.stdout.buffer.write(output)
+        sys.exit(status)
@@ -0,0 +1,186 @@
+"""Arc-length geometry of poly-Bézier paths.
+
+Places arrows and momentum labels at the true middle (half of the length) of a path made of
+any number of cubic segments, instead of the parametric middle of its first and last node.
+Each path is sampled once with NumPy into an arc-length lookup table, cached by geometry.
+The same tables bend pattern tiles along a path, to bake propagators into static path data.
+Path data is written with quantized coordinates and relative commands (compact_path).
+The edges of generated diagrams get their geometry for all of them at once (edge_geometry).
+"""
+import numpy as np
+
+# Samples per cubic segment of the lookup tables
+SAMPLES = 32
+# Number of lookup tables kept in memory
+CACHE_SIZE = 4096
+
+_T = np.linspace(0.0, 1.0, SAMPLES + 1)
+# Bernstein basis of the cubic Bézier at the sample parameters, shape (SAMPLES + 1, 4)
+_BASIS = np.stack([(1 - _T) ** 3, 3 * (1 - _T) ** 2 * _T, 3 * (1 - _T) * _T ** 2, _T ** 3], axis=1)
+_tables = {}
+
+def cubic_segments(csp):
+    """Return the cubic segments of the first subpath of a CubicSuperPath as an (n, 4, 2) array."""
+    sub = csp[0]
+    return np.array([(sub[i][1], sub[i][2], sub[i + 1][0], sub[i + 1][1]) for i in range(len(sub) - 1)],
+                    dtype=float).reshape(-1, 4, 2)
+
+def bezier_point(segment, t):
+    """Point of a cubic segment (4, 2) at parameter t."""
+    s = 1 - t
+    return s ** 3 * segment[0] + 3 * s * s * t * segment[1] + 3 * s * t * t * segment[2] + t ** 3 * segment[3]
+
+def bezier_derivative(segment, t):
+    """Derivative of a cubic segment (4, 2) at parameter t."""
+    s = 1 - t
+    return 3 * (s * s * (segment[1] - segment[0]) + 2 * s * t * (segment[2] - segment[1]) + t * t * (segment[3] - segment[2]))
+
+class ArcLengthTable:
+    """Cumulative length of a poly-Bézier, sampled SAMPLES times per segment."""
+    __slots__ = ("segments", "samples", "cumulative", "length")
+
+    def __init__(self, segments):
+        self.segments = segments
+        # All the segments are sampled at once: (n, SAMPLES + 1, 2)
+        self.samples = np.einsum('kj,njd->nkd', _BASIS, segments)
+        steps = np.diff(self.samples, axis=1)
+        lengths = np.hypot(steps[..., 0], steps[..., 1]).ravel()
+        self.cumulative = np.concatenate(([0.0], np.cumsum(lengths)))
+        self.length = float(self.cumulative[-1])
+
+    def locate(self, s):
+        """Return (segment index, parameter t) of the point at arc length s."""
+        cumulative = self.cumulative
+        i = int(np.searchsorted(cumulative, s, side='right')) - 1
+        i = min(max(i, 0), len(cumulative) - 2)
+        step = cumulative[i + 1] - cumulative[i]
+        frac = (s - cumulative[i]) / step if step > 0 else 0.0
+        index, k = divmod(i, SAMPLES)
+        return index, (k + min(max(frac, 0.0), 1.0)) / SAMPLES
+
+    def frame(self, fraction=0.5):
+        """Return (point, unit tangent, unit normal) at the given fraction of the length,
+            or None for a path without length."""
+        if self.length <= 0: return None
+        index, t = self.locate(self.length * fraction)
+        segment = self.segments[index]
+        point = bezier_point(segment, t)
+        tangent = bezier_derivative(segment, t)
+        norm = np.hypot(*tangent)
+        if norm < 1e-9:
+            # Degenerate handles: use the sampled chord around the point
+            k = min(int(t * SAMPLES), SAMPLES - 1)
+            tangent = self.samples[index, k + 1] - self.samples[index, k]
+            norm = np.hypot(*tangent)
+            if norm < 1e-9: return None
+        ux, uy = tangent / norm
+        return (float(point[0]), float(point[1])), (float(ux), float(uy)), (float(-uy), float(ux))
+
+    def frames(self, s):
+        """Return the points (m, 2) and unit normals (m, 2) at the arc lengths s (m,), all at once."""
+        cumulative = self.cumulative
+        i = np.clip(np.searchsorted(cumulative, s, side='right') - 1, 0, len(cumulative) - 2)
+        step = cumulative[i + 1] - cumulative[i]
+        frac = np.divide(s - cumulative[i], step, out=np.zeros_like(s), where=step > 0)
+        index, k = np.divmod(i, SAMPLES)
+        t = ((k + np.clip(frac, 0.0, 1.0)) / SAMPLES)[:, None]
+        segments = self.segments[index].transpose(1, 0, 2)
+        points = bezier_point(segments, t)
+        tangents = bezier_derivative(segments, t)
+        norms = np.hypot(tangents[:, 0], tangents[:, 1])
+        degenerate = norms < 1e-9
+        if degenerate.any():
+            # Degenerate handles: use the sampled chords around the points
+            chords = self.samples[index, k + 1] - self.samples[index, k]
+            tangents[degenerate] = chords[degenerate]
+            norms = np.hypot(tangents[:, 0], tangents[:, 1])
+            norms[norms < 1e-9] = 1.0
+        tangents /= norms[:, None]
+        return points, np.stack([-tangents[:, 1], tangents[:, 0]], axis=1)
+
+def arc_length_table(csp):
+    """Return the (cached) arc-length table of the first subpath of a CubicSuperPath, or None if it has no segment."""
+    segments = cubic_segments(csp)
+    if len(segments) == 0: return None
+    key = segments.tobytes()
+    table = _tables.get(key)
+    if table is None:
+        if len(_tables) >= CACHE_SIZE:
+            _tables.pop(next(iter(_tables)))
+        table = _tables[key] = ArcLengthTable(segments)
+    return table
+
+def path_frame(csp, fraction=0.5):
+    """Return (point, unit tangent, unit normal) at the given fraction of the length of a
+        CubicSuperPath (default: its middle), or None if it is degenerate."""
+    table = arc_length_table(csp)
+    return table.frame(fraction) if table is not None else None
+
+def pattern_tile(csp):
+    """Return (segments, width, height) of a pattern: its cubic segments with x scaled to [0, 1]
+        along the tile and y centred on its middle line and divided by its height, and its size."""
+    segments = cubic_segments(csp)
+    samples = np.einsum('kj,njd->nkd', _BASIS, segments).reshape(-1, 2)
+    (x0, y0), (x1, y1) = samples.min(axis=0), samples.max(axis=0)
+    width, height = (x1 - x0) or 1.0, (y1 - y0) or 1.0
+    return (segments - (x0, (y0 + y1) / 2)) / (width, height), float(width), float(height)
+
+def bake_pattern(csp, tile, tile_length, offset=0.0):
+    """Bend copies of a pattern tile along the first subpath of a CubicSuperPath, stretched to a
+        whole number of copies like Inkscape's "repeated, stretched" pattern along path.
+        tile: (n, 4, 2) segments with x in [0, 1] along the path and y in document units across it.
+        Returns the (copies * n, 4, 2) segments of the result, or None for a path without length."""
+    table = arc_length_table(csp)
+    if table is None or table.length <= 0: return None
+    copies = max(1, int(round(table.length / tile_length)))
+    along = (np.arange(copies)[:, None, None] + tile[None, ..., 0]).ravel() * (table.length / copies)
+    across = np.broadcast_to(tile[..., 1], (copies,) + tile.shape[:2]).ravel() + offset
+    # Control points are moved with the frame at their own arc length: exact on straight paths,
+    # and close on curves as a tile is short compared to the bends of a propagator
+    points, normals = table.frames(along)
+    return (points + normals * across[:, None]).reshape(-1, 4, 2)
+
+def edge_geometry(starts, ends, bends, offset=(0.0, 0.0), precision=3):
+    """Return the geometry of straight or bent edges, for all the edges at once: the arrays of their
+        starts, control points, ends (n, 2), whether they are bent (n,), and their middles and unit
+        tangents (n, 2). A bent edge is a quadratic curve whose control point is moved off the middle
+        of the chord by bend times its length, perpendicularly; by symmetry its middle (half of the
+        length) is at t = 0.5. The points are moved by offset and rounded to precision decimals, as
+        in the path data. The tangents of edges without length are (0, 0)."""
+    p0 = np.asarray(starts, dtype=float).reshape(-1, 2) + offset
+    p2 = np.asarray(ends, dtype=float).reshape(-1, 2) + offset
+    bends = np.asarray(bends, dtype=float)
+    chord = p2 - p0
+    bent = (bends != 0) & (np.hypot(chord[:, 0], chord[:, 1]) > 0.001)
+    control = (p0 + p2) / 2 + np.stack([-chord[:, 1], chord[:, 0]], axis=1) * bends[:, None]
+    p0, p2, control = np.round(p0, precision), np.round(p2, precision), np.round(control, precision)
+    control = np.where(bent[:, None], control, (p0 + p2) / 2)
+    chord = p2 - p0
+    length = np.hypot(chord[:, 0], chord[:, 1])[:, None]
+    tangent = np.divide(chord, length, out=np.zeros_like(chord), where=length > 1e-9)
+    return p0, control, p2, bent, (p0 + 2 * control + p2) / 4, tangent
+
+def format_number(value, precision=3):
+    """Return value rounded to precision decimals, without trailing zeros."""
+    text = f"{value:.{max(precision, 0)}f}"
+    if '.' in text: text = text.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+def compact_path(commands, precision=3):
+    """Return the path data of absolute commands (letter, (x, y), ...), with letter in M, L, Q, C,
+        as relative commands with coordinates rounded to precision decimals. The points are rounded
+        before the differences are taken, so that rounding errors do not add up along the path."""
+    factor = 10 ** precision
+    parts, last, cx, cy = [], None, 0, 0
+    for letter, *points in commands:
+        letter = letter.lower()
+        coords = []
+        for x, y in points:
+            qx, qy = round(x * factor), round(y * factor)
+            coords.append(f"{format_number((qx - cx) / factor, precision)},{format_number((qy - cy) / factor, precision)}")
+            if letter in 'ml': cx, cy = qx, qy
+        if letter in 'qc': cx, cy = qx, qy
+        # A repeated command letter may be left out (after m, coordinates would mean l)
+        parts.append(' '.join(coords) if letter == last and letter != 'm' else letter + ' '.join(coords))
+        last = letter
+    return ' '.join(parts)
@@ -0,0 +1,320 @@
+"""Generate Feynman diagrams without Inkscape.
+
+Python API:
+    from feynman_headless import render
+    svg = render("e+ e- > gamma > mu+ mu-", p_type="photon")
+    render(data=geometry, output="diagram.svg")
+
+Very large diagrams can be streamed to the output edge by edge, with bounded memory:
+    stream_extension(make_extension(), geometry, "lattice.svg")
+
+Large batches can be spread over a process pool, merged into one document or
+written to one file per reaction:
+    from feynman_headless import render_parallel
+    render_parallel(reactions, output="catalogue.svg", jobs=8)
+    render_parallel(reactions, output_pattern="out/diagram_{index:04d}.svg")
+
+Command line (extension options are accepted too, written as --name=value, e.g. --gen_x_spacing=200):
+    python feynman_headless.py "e+ e- > gamma > mu+ mu-" -o diagram.svg
+    python feynman_headless.py --data geometry.json > diagram.svg
+    python feynman_headless.py --data lattice.json --stream -o lattice.svg
+    python feynman_headless.py --gen_batch_file=reactions.txt --jobs=8 -o catalogue.svg
+"""
+import os
+import sys
+import json
+import argparse
+import concurrent.futures
+import inkex
+from feynman_logic import FeynmanLogic
+
+NS_INK = "http://www.inkscape.org/namespaces/inkscape"
+
+MARGIN = 20
+
+def make_extension(args=(), **options):
+    """Return a FeynmanLogic instance working on a new empty document."""
+    ext = FeynmanLogic()
+    ext.parse_arguments(list(args) + [f"--{key}={value}" for key, value in options.items()])
+    ext.document = ext.get_template(width=100, height=100)
+    ext.svg = ext.document.getroot()
+    return ext
+
+def fit_document(ext):
+    """Resize the document to the drawn content."""
+    # Reading the transforms makes inkex write them again as full precision matrices: keep them as written
+    written = [(node, node.attrib['transform']) for node in ext.svg.iter(inkex.etree.Element) if 'transform' in node.attrib]
+    bbox = inkex.BoundingBox()
+    for child in ext.svg:
+        if isinstance(child, inkex.ShapeElement) and not isinstance(child, inkex.Defs):
+            child_bbox = child.bounding_box()
+            if child_bbox is not None: bbox += child_bbox
+    for node, value in written:
+        inkex.etree.ElementBase.set(node, 'transform', value)
+    if not bbox: return
+    x, y = bbox.left - MARGIN, bbox.top - MARGIN
+    width, height = bbox.width + 2 * MARGIN, bbox.height + 2 * MARGIN
+    ext.svg.set('viewBox', f"{x} {y} {width} {height}")
+    ext.svg.set('width', str(width))
+    ext.svg.set('height', str(height))
+
+def write_document(ext, output):
+    """Write the document to a file name or a binary stream, and return it as bytes."""
+    svg = ext.svg.tostring()
+    if isinstance(output, str):
+        with open(output, 'wb') as f:
+            f.write(svg)
+    elif output is not None:
+        output.write(svg)
+    return svg
+
+def render_extension(ext, syntax=None, data=None, output=None):
+    """Draw reactions (str or list of str) or precomputed geometry with ext, and write the result.
+        If a reaction could not be generated, nothing is written and None is returned, unless the
+        errors are drawn in the document (quiet_error option)."""
+    ext.start_profiling()
+    if data is not None:
+        ext.generate_diagram(data)
+        if ext.options.compact_defs:
+            ext.compact_defs()
+    else:
+        if not isinstance(syntax, str):
+            syntax = '\n'.join(syntax)
+        ext.options.gen_syntax = syntax
+        ext.effect()
+    if ext.generation_errors and not ext.options.quiet_error:
+        ext.finish_profiling()
+        return None
+    fit_document(ext)
+    with ext.stats.phase('serialize'):
+        svg = write_document(ext, output)
+    ext.report_path = output if isinstance(output, str) else None
+    ext.finish_profiling()
+    return svg
+
+def stream_extension(ext, data, output, origin=(50, 50)):
+    """Draw pyfeyngen geometry with ext straight to output (file name or binary stream), edge by
+        edge: each edge is written and dropped from the tree once drawn, so memory does not grow
+        with the number of edges. data['edges'] may be any iterable. The shared definitions are
+        written after the drawing, and the document is sized from the nodes."""
+    ext.start_profiling()
+    ext.index_document()
+    min_x, min_y, width, height = ext.diagram_extent(data)
+    x, y = origin[0] + min_x - MARGIN, origin[1] + min_y - MARGIN
+    width, height = width + 2 * MARGIN, height + 2 * MARGIN
+    ext.svg.set('viewBox', f"{x} {y} {width} {height}")
+    ext.svg.set('width', str(width))
+    ext.svg.set('height', str(height))
+    # Edges are drawn in a scratch group, emptied after each of them
+    scratch = inkex.Group()
+    ext.svg.add(scratch)
+    stream = open(output, 'wb') if isinstance(output, str) else output
+    try:
+        root = inkex.etree.Element(ext.svg.tag, dict(ext.svg.attrib), nsmap=ext.svg.nsmap)
+        root.text = '\n'
+        head, tail = inkex.etree.tostring(root).rsplit(b'\n', 1)
+        stream.write(head + b'\n')
+        # lxml declares the namespaces of the document again on every element written on its own
+        declarations = [(f' xmlns:{prefix}="{uri}"' if prefix else f' xmlns="{uri}"').encode('utf-8')
+                        for prefix, uri in ext.svg.nsmap.items()]
+
+        def serialize(node):
+            xml = inkex.etree.tostring(node, with_tail=False)
+            end = xml.index(b'>')
+            start_tag = xml[:end]
+            for declaration in declarations:
+                start_tag = start_tag.replace(declaration, b'', 1)
+            return start_tag + xml[end:]
+
+        def write(node):
+            stream.write(serialize(node) + b'\n')
+
+        for node in ext.svg:
+            if node is not scratch and not isinstance(node, inkex.Defs): write(node)
+        # The diagram scale, if any, is the transform of a group around the whole diagram
+        layer, origin = ext.diagram_layer(scratch, origin)
+        if layer is not scratch:
+            layer.text = '\n'
+            layer_head, layer_tail = serialize(layer).rsplit(b'\n', 1)
+            stream.write(layer_head + b'\n')
+        for _ in ext.iter_diagram(data, parent=layer, origin=origin):
+            for node in list(layer):
+                with ext.stats.phase('serialize'):
+                    write(node)
+                ext.delete_element(node)
+        if layer is not scratch:
+            stream.write(layer_tail + b'\n')
+        write(ext.svg.defs)
+        stream.write(tail)
+    finally:
+        if stream is not output: stream.close()
+    scratch.delete()
+    ext.report_path = output if isinstance(output, str) else None
+    ext.finish_profiling()
+
+def render(syntax=None, data=None, output=None, **options):
+    """Render reactions, or pyfeyngen geometry (data['nodes'] / data['edges']), to SVG.
+        options are the extension options (p_type, gen_x_spacing, quiet_error...).
+        Returns the SVG as bytes, and also writes it to output (file name or binary stream) if given,
+        or None if a reaction could not be generated (see render_extension)."""
+    if (syntax is None) == (data is None):
+        raise ValueError("Give either a reaction syntax or precomputed geometry data")
+    return render_extension(make_extension(**options), syntax, data, output)
+
+def render_fragment(task):
+    """Worker: lay out and draw one reaction on its own document.
+        Returns (index, syntax, diagram group XML, defs XML, extent, error message)."""
+    index, syntax, args = task
+    ext = make_extension(args)
+    try:
+        data = ext.compute_geometry(syntax)
+        group = ext.add_diagram_group(syntax, ext.svg)
+        min_x, min_y, width, height = ext.diagram_extent(data)
+        ext.generate_diagram(data, parent=group, origin=(-min_x, -min_y))
+    except Exception as e:
+        return index, syntax, None, [], None, str(e)
+    defs = [inkex.etree.tostring(node) for node in ext.svg.defs]
+    return index, syntax, inkex.etree.tostring(group), defs, (0, 0, width, height), None
+
+def render_file(task):
+    """Worker: draw one reaction into its own SVG file.
+        Returns (index, output file or None if not written, error message)."""
+    index, syntax, args, output = task
+    ext = make_extension(args)
+    ext.options.gen_batch_file = ""
+    if render_extension(ext, syntax=syntax, output=output) is None: output = None
+    return index, output, str(ext.generation_errors[0][1]) if ext.generation_errors else None
+
+def merge_defs(ext, defs):
+    """Add the definitions of a fragment to the document, reusing existing ones.
+        Returns the mapping from the fragment LPE ids to the document ones."""
+    remap = {}
+    for xml in defs:
+        node = inkex.load_svg(xml).getroot()
+        node_id = node.get('id')
+        if node_id is None: continue
+        if node_id.startswith(ext.DEF_PREFIXES):
+            if ext.find_def(node_id) is None:
+                ext.svg.defs.add(node)
+                ext.register_element(node)
+            continue
+        key = ext.lpe_key(node) if node.tag == f"{{{NS_INK}}}path-effect" else None
+        if key is not None and ext.lpe_cache.get(key) in ext.id_index:
+            remap[node_id] = ext.lpe_cache[key]
+            continue
+        new_id = ext.get_unique_id("lpe" if key is not None else node_id.rstrip("0123456789"))
+        node.set('id', new_id)
+        ext.svg.defs.add(node)
+        ext.register_element(node)
+        if key is not None: ext.lpe_cache[key] = new_id
+        remap[node_id] = new_id
+    return remap
+
+def merge_fragment(ext, group_xml, remap, parent, x, y):
+    """Add a diagram group built by a worker to the document at (x, y), renaming its IDs to unique ones."""
+    group = inkex.load_svg(group_xml).getroot()
+    for node in group.iter(inkex.etree.Element):
+        node_id = node.get('id')
+        if node_id is not None:
+            remap[node_id] = ext.get_unique_id(node_id.rstrip("0123456789"))
+            node.set('id', remap[node_id])
+            ext.register_element(node)
+    for node in group.iter(inkex.etree.Element):
+        for attr in ext.LINK_ATTRIBUTES:
+            if node.get(attr) in remap: node.set(attr, remap[node.get(attr)])
+        effects = node.get(f"{{{NS_INK}}}path-effect")
+        if effects:
+            refs = [ref.strip() for ref in effects.split(';')]
+            node.set(f"{{{NS_INK}}}path-effect", ';'.join('#' + remap.get(ref[1:], ref[1:]) for ref in refs))
+    group.transform = inkex.Transform(translate=(x, y))
+    parent.add(group)
+
+def render_parallel(syntaxes, output=None, output_pattern=None, jobs=None, args=(), **options):
+    """Render many reactions on a process pool (jobs workers, default: one per CPU).
+        With output_pattern (e.g. "diagram_{index}.svg"), each reaction goes to its own file and the
+        list of file names is returned (None for the reactions which failed, see render_extension). Otherwise the diagrams are merged, in the input order, into one
+        grid document with shared defs, written to output and returned as bytes.
+        Returns (result, errors), errors being the list of (syntax, message) of the failed reactions."""
+    args = list(args) + [f"--{key}={value}" for key, value in options.items()]
+    # The cache is cleared once here (if asked), never by the workers
+    make_extension(args).get_layout_cache()
+    args.append("--gen_cache_clear=false")
+    jobs = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(syntaxes) // (jobs * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        if output_pattern:
+            tasks = [(i, syntax, args, output_pattern.format(index=i)) for i, syntax in enumerate(syntaxes)]
+            results = list(pool.map(render_file, tasks, chunksize=chunksize))
+            errors = [(syntaxes[index], error) for index, _, error in results if error is not None]
+            return [name for _, name, _ in results], errors
+        tasks = [(i, syntax, args) for i, syntax in enumerate(syntaxes)]
+        fragments = list(pool.map(render_fragment, tasks, chunksize=chunksize))
+
+    ext = make_extension(args)
+    ext.start_profiling()
+    ext.index_document()
+    layer = ext.svg.get_current_layer()
+    cell = ext.grid_cell([extent for *_, extent, error in fragments if error is None])
+    for index, syntax, group_xml, defs, _, error in fragments:
+        x, y = ext.grid_origin(index, cell)
+        if error is not None:
+            ext.report_error(error, x, y, layer, syntax)
+            continue
+        merge_fragment(ext, group_xml, merge_defs(ext, defs), layer, x, y)
+    fit_document(ext)
+    with ext.stats.phase('serialize'):
+        svg = write_document(ext, output)
+    ext.report_path = output if isinstance(output, str) else None
+    ext.finish_profiling()
+    return svg, [(syntax, str(error)) for syntax, error in ext.generation_errors]
+
+def main(argv=None):
+    """Command line entry point. Returns the exit status."""
+    parser = argparse.ArgumentParser(description="Generate Feynman diagrams as SVG without Inkscape.")
+    parser.add_argument("syntax", nargs="*", help="Reaction(s), e.g. 'e+ e- > gamma > mu+ mu-'")
+    parser.add_argument("--data", help="JSON file with precomputed geometry (nodes and edges)")
+    parser.add_argument("-o", "--output", help="Output SVG file (default: stdout)")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes (0: one per CPU)")
+    parser.add_argument("--output-pattern", help="Write one file per reaction, e.g. 'diagram_{index:04d}.svg'")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write the edges while drawing them, to keep memory low on huge diagrams (one reaction)")
+    args, extension_args = parser.parse_known_args(argv)
+
+    ext = make_extension(extension_args)
+    if args.jobs != 1 or args.output_pattern:
+        try:
+            syntaxes = args.syntax + ext.get_syntaxes()
+        except (OSError, ValueError) as e:
+            ext.report_error(e)
+            return 1
+        if not syntaxes:
+            parser.error("a reaction syntax or --gen_batch_file is required")
+        output = args.output or sys.stdout.buffer
+        _, errors = render_parallel(syntaxes, output, args.output_pattern, args.jobs or None, extension_args)
+        return 1 if errors else 0
+    if args.stream:
+        if args.data:
+            with open(args.data, encoding='utf-8') as f:
+                data = json.load(f)
+        elif len(args.syntax) == 1 or ext.options.gen_syntax:
+            syntax = args.syntax[0] if args.syntax else ext.options.gen_syntax
+            try:
+                data = ext.compute_geometry(syntax)
+            except Exception as e:
+                ext.report_error(e, syntax=syntax)
+                return 1
+        else:
+            parser.error("--stream needs one reaction syntax or --data")
+        stream_extension(ext, data, args.output or sys.stdout.buffer)
+    elif args.data:
+        with open(args.data, encoding='utf-8') as f:
+            data = json.load(f)
+        render_extension(ext, data=data, output=args.output or sys.stdout.buffer)
+    elif args.syntax or ext.options.gen_syntax or ext.options.gen_batch_file:
+        render_extension(ext, syntax=args.syntax or ext.options.gen_syntax, output=args.output or sys.stdout.buffer)
+    else:
+        parser.error("a reaction syntax, --gen_batch_file or --data is required")
+    return 1 if ext.generation_errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
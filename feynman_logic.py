@@ -1,22 +1,82 @@
+import os
 import math
+import json
+import sqlite3
+import hashlib
+import itertools
+from typing import NamedTuple
 import inkex
-from inkex import PathElement, Circle, Rectangle, Marker
+from inkex import PathElement, Circle, Rectangle, Marker, Group, Symbol, Use
+from feynman_profile import RunStats, timed
+from feynman_geometry import path_frame, pattern_tile, bake_pattern, arc_length_table, compact_path, format_number, edge_geometry
+from feynman_placement import LabelPlacer, text_box, segment_box
+
+class FeynmanStyle(NamedTuple):
+    """Settings used to draw one propagator, resolved once per path or edge."""
+    p_type: str = "photon"
+    amplitude: float = 5.0
+    arrow_type: str = "none"
+    momentum_arrow: str = "none"
+    momentum_label: str = ""
+    momentum_offset: float = 12.0
+    momentum_length: float = 12.0
+    label_latex: bool = False
+    v_style: str = "none"
+    v_size: float = 3.0
+    v_location: str = "both"
+    v_apply_all: bool = False
+    propagator_mode: str = "live"
+
+def multiline_field(value : str):
+    """Argument type of a multi-line field of the dialog: Inkscape sends its newlines as literal \\n
+        sequences. Reactions given to the Python API or as arguments of feynman_headless.py are kept as is."""
+    return value.replace('\\n', '\n')
+
+class PathGeometry:
+    """Geometry of a path for one run: its skeleton, its transform to the document, its nodes in
+        the coordinates of its parent, its ends there and its middle frame (computed on first use)."""
+    __slots__ = ("skeleton", "transform", "superpath", "start", "end", "_frame")
+
+    def __init__(self, skeleton, transform, superpath, frame=False):
+        self.skeleton = skeleton
+        self.transform = transform
+        self.superpath = superpath
+        if superpath and superpath[0]:
+            self.start, self.end = tuple(superpath[0][0][1]), tuple(superpath[0][-1][1])
+        else:
+            self.start = self.end = None
+        self._frame = frame
+
+    @property
+    def frame(self):
+        """(middle point, unit tangent, unit normal) at half of the length, or None if degenerate."""
+        if self._frame is False:
+            self._frame = path_frame(self.superpath) if self.start is not None else None
+        return self._frame
 
 class FeynmanLogic(inkex.EffectExtension):
-    #Helpers functions
-    def lerp(self, a, b, t=0.5):
-        '''Linear interpolation function for points'''
-        return [a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t]
-
-    def casteljau_midpoint(self, p0, c0, c1, p1):
-        """Compute the midpoint (t=0.5) of a cubic Bezier curve using De Casteljau's algorithm."""
-        m1 = self.lerp(p0, c0)
-        m2 = self.lerp(c0, c1)
-        m3 = self.lerp(c1, p1)
-        q1 = self.lerp(m1, m2)
-        q2 = self.lerp(m2, m3)
-        mid_p = self.lerp(q1, q2)
-        return q1, mid_p, q2
+    # Prefixes of the shared definitions created by the extension in <defs>
+    DEF_PREFIXES = ("fref_", "fmarker_", "farrow_", "fvertex_")
+    # Attributes linking a path to its ghost, momentum arrow, label and vertices
+    LINK_ATTRIBUTES = ('data-feynman-ghost', 'data-feynman-ghost-arrow', 'data-feynman-label', 'data-feynman-vertices')
+    # Attribute holding the fingerprint of the settings and geometry applied to a path
+    FINGERPRINT_ATTRIBUTE = 'data-feynman-fingerprint'
+    # Edges whose geometry is computed at once
+    EDGE_BATCH = 1024
+
+    def __init__(self):
+        super().__init__()
+        self.id_index = None
+        self.feynman_defs = {}
+        self.id_counters = {}
+        self.lpe_cache = {}
+        self.generation_errors = []
+        self.layout_cache = None
+        self.stats = RunStats()
+        self.report_path = None
+        self.label_placer = None
+        self.geometry_cache = {}
+        self.transform_cache = {}
 
     patterns = {
         "photon": {"d": "m 0,0 c 5,-10 10,10 15,0", "normal_offset": 0},
@@ -28,6 +88,8 @@ class FeynmanLogic(inkex.EffectExtension):
         "ghost": {"d": "m 0,0 h 10", "normal_offset": 0, "dash": "1, 3"},
         "scalar": {"d": "m 0,0 h 10", "normal_offset": 0, "dash": "5, 5"},
     }
+    # Baked pattern tiles, by (particle type, amplitude)
+    pattern_tiles = {}
 
     def add_arguments(self, pars):
         pars.add_argument("--tabs", type=str, dest="tab")
@@ -42,70 +104,408 @@ class FeynmanLogic(inkex.EffectExtension):
         pars.add_argument("--momentum_offset", type=float, default=12.0)
         pars.add_argument("--momentum_length", type=float, default=12.0)
         pars.add_argument("--momentum_label", type=str, default="")
-        pars.add_argument("--gen_syntax", type=str, default="")
+        pars.add_argument("--gen_syntax", type=multiline_field, default="")
         pars.add_argument("--gen_scale", type=float, default=1.0)
         pars.add_argument("--label_latex", type=inkex.Boolean, default=False)
         pars.add_argument("--quiet_error", type=inkex.Boolean, default=False)
         pars.add_argument("--gen_x_spacing", type=int, default=150)
         pars.add_argument("--gen_y_spacing", type=int, default=100)
-
+        pars.add_argument("--compact_defs", type=inkex.Boolean, default=False)
+        pars.add_argument("--gen_batch_file", type=str, default="")
+        pars.add_argument("--gen_columns", type=int, default=4)
+        pars.add_argument("--gen_batch_spacing", type=float, default=50.0)
+        pars.add_argument("--gen_cache", type=inkex.Boolean, default=True)
+        pars.add_argument("--gen_cache_size", type=int, default=20)
+        pars.add_argument("--gen_cache_clear", type=inkex.Boolean, default=False)
+        pars.add_argument("--profile", type=str, default="none")
+        pars.add_argument("--propagator_mode", type=str, default="live")
+        pars.add_argument("--avoid_overlaps", type=inkex.Boolean, default=False)
+        pars.add_argument("--precision", type=int, default=3)
+
+    #Instrumentation
+    def start_profiling(self):
+        """Start recording timings if enabled by the profile option or the PYINKFEYN_PROFILE variable."""
+        mode = self.options.profile
+        if mode == "none":
+            mode = os.environ.get('PYINKFEYN_PROFILE', 'none')
+        self.stats.enable(mode)
+
+    def finish_profiling(self):
+        """Write the timings of the run next to the document, if profiling is enabled."""
+        self.stats.write(self.report_path or os.environ.get('DOCUMENT_PATH'))
+
+    def load_raw(self):
+        self.start_profiling()
+        with self.stats.phase('parse'):
+            super().load_raw()
+
+    def save_raw(self, ret):
+        with self.stats.phase('serialize'):
+            super().save_raw(ret)
+        self.finish_profiling()
+
+    #Document index
+    @timed('index_document')
+    def index_document(self):
+        """Build the id -> element index (and the registry of Feynman defs) used by every lookup of the run."""
+        NS_INK = "http://www.inkscape.org/namespaces/inkscape"
+        self.id_index = {}
+        self.feynman_defs = {}
+        self.lpe_cache = {}
+        for node in self.svg.iter(inkex.etree.Element):
+            eid = node.get('id')
+            if eid is not None:
+                self.id_index[eid] = node
+                if eid.startswith(self.DEF_PREFIXES):
+                    self.feynman_defs[eid] = node
+                elif node.tag == f"{{{NS_INK}}}path-effect":
+                    key = self.lpe_key(node)
+                    if key is not None: self.lpe_cache.setdefault(key, eid)
+
+    def get_element(self, eid : str):
+        """Return the element with the given ID, or None, using the document index."""
+        if self.id_index is None: self.index_document()
+        return self.id_index.get(eid)
+
+    def find_def(self, def_id : str):
+        """Return the Feynman definition (pattern, marker, arrow) with the given ID, or None."""
+        if self.id_index is None: self.index_document()
+        return self.feynman_defs.get(def_id)
+
+    def register_element(self, elem):
+        """Add a newly created element to the document index."""
+        if self.id_index is None: self.index_document()
+        eid = elem.get('id')
+        if eid is None: return
+        self.id_index[eid] = elem
+        if eid.startswith(self.DEF_PREFIXES):
+            self.feynman_defs[eid] = elem
+        if self.stats.enabled:
+            self.stats.count(eid.split('_')[0] if '_' in eid else eid.rstrip('0123456789'))
+
+    def delete_element(self, elem):
+        """Remove an element (and its children) from the document, the index and the geometry caches."""
+        for node in elem.iter(inkex.etree.Element):
+            self.geometry_cache.pop(node, None)
+            self.transform_cache.pop(node, None)
+            eid = node.get('id')
+            if eid is not None and self.id_index is not None:
+                self.id_index.pop(eid, None)
+                self.feynman_defs.pop(eid, None)
+        elem.delete()
+
+    def composed_transform(self, node):
+        """Return the transform from the coordinates of a group (or layer) to the document's,
+            memoized for the run."""
+        transform = self.transform_cache.get(node)
+        if transform is None:
+            parent = node.getparent()
+            # Read without node.transform, which would write the attribute again as a matrix
+            transform = inkex.Transform(inkex.etree.ElementBase.get(node, 'transform'))
+            if isinstance(parent, inkex.BaseElement):
+                transform = self.composed_transform(parent) @ transform
+            self.transform_cache[node] = transform
+        return transform
+
+    def path_geometry(self, elem:inkex.PathElement):
+        """Return the geometry record of a path, computed once per run and shared by every helper."""
+        record = self.geometry_cache.get(elem)
+        if record is None:
+            parent = elem.getparent()
+            transform = self.composed_transform(parent) @ elem.transform if parent is not None else elem.transform
+            skeleton = self.get_skeleton_path(elem)
+            record = self.geometry_cache[elem] = PathGeometry(skeleton, transform, skeleton.transform(elem.transform).to_superpath())
+        return record
+
+    def get_unique_id(self, prefix : str):
+        """Return an ID starting with prefix that is not used in the document."""
+        if self.id_index is None: self.index_document()
+        n = self.id_counters.get(prefix, 0)
+        while True:
+            n += 1
+            new_id = f"{prefix}{n}"
+            if new_id not in self.id_index: break
+        self.id_counters[prefix] = n
+        return new_id
+
+    def format_number(self, value):
+        """Write a coordinate with the precision chosen in the options."""
+        return format_number(value, self.options.precision)
+
+    def set_transform(self, elem, transform : str):
+        """Set the transform attribute of an element as written, with its rounded numbers
+            (inkex would write it again as a full precision matrix)."""
+        inkex.etree.ElementBase.set(elem, 'transform', transform)
+
+    def format_path(self, commands):
+        """Write absolute path commands as compact path data, with the precision chosen in the options."""
+        return compact_path(commands, self.options.precision)
+
+    @timed('effect')
     def effect(self):
         """Main entry point for the extension. Handles both auto-draw and manual selection modes."""
-        syntax = self.options.gen_syntax.strip()
-        if syntax:
+        self.index_document()
+        try:
+            syntaxes = self.get_syntaxes()
+        except (OSError, ValueError) as e:
+            self.report_error(e)
+            return
+        if len(syntaxes) > 1 or (syntaxes and self.options.gen_batch_file):
+            self.generate_batch(syntaxes)
+            if self.options.compact_defs:
+                self.compact_defs()
+            return
+        if syntaxes:
             try:
-                import pyfeyngen
-                data = pyfeyngen.quick_geometry(syntax, self.options.gen_x_spacing, self.options.gen_y_spacing)
+                data = self.compute_geometry(syntaxes[0])
                 self.generate_diagram(data)
+                if self.options.compact_defs:
+                    self.compact_defs()
                 return
 
             except Exception as e:
-                if self.options.quiet_error:
-                    label = inkex.TextElement()
-                    lid = self.svg.get_unique_id("label")
-                    label.set('id', lid)
-                    label.text = f"Error : {str(e)}"
-                    label.set('x', '50')
-                    label.set('y', '50')
-                    label.style = {
-                        'font-size': '12px',
-                        'fill': 'red',
-                        'text-anchor': 'middle',
-                        'dominant-baseline': 'middle',
-                        'font-family': 'sans-serif'
-                    }
-                    self.svg.get_current_layer().add(label)
-                else:
-                    inkex.errormsg(f"Error/Warning when generating : {str(e)}")
+                self.report_error(e)
                 return
-        direction_save = self.options.arrow_type
-        direction_momentum_save = self.options.momentum_arrow
-        for elem in self.svg.selection:
-            self.options.arrow_type = direction_save
-            self.options.momentum_arrow = direction_momentum_save
-            if isinstance(elem, inkex.PathElement):
-                self.remove_linked_ghost(elem)
-                if self.options.p_type != "no_change":
-                    self.reset_path(elem)
-                    self.apply_particle_lpe(elem)
-                self.apply_vertices(elem)
-
-                if self.options.arrow_type != "none":
-                    self.options.arrow_type = self.get_arrow_direction(elem, self.options.arrow_type)
-                    self.apply_separate_arrow(elem)
-
-                if self.options.momentum_arrow != "none" or self.options.momentum_label:
-                    self.options.momentum_arrow = self.get_arrow_direction(elem, self.options.momentum_arrow)
-                    self.apply_momentum_flow(elem)
-
-    def remove_linked_ghost(self,  elem:inkex.PathElement):
+        style = self.style_from_options()
+        paths = [elem for elem in self.svg.selection if isinstance(elem, inkex.PathElement)]
+        if self.get_label_placer() is not None:
+            self.seed_label_placer(paths, style)
+        for elem in paths:
+            self.style_path(elem, style)
+
+        if self.options.compact_defs:
+            self.compact_defs()
+
+    def get_syntaxes(self):
+        """Return the reaction strings to generate, from the batch file and/or the (multi-line) syntax field.
+            Raises OSError if the batch file cannot be read, ValueError if it is malformed."""
+        lines = self.options.gen_syntax.splitlines()
+        path = self.options.gen_batch_file.strip()
+        if path:
+            with open(path, encoding='utf-8') as f:
+                if path.lower().endswith('.json'):
+                    entries = json.load(f)
+                    if not isinstance(entries, list):
+                        raise ValueError(f"{path} : a JSON batch file must hold a list of reactions")
+                    for entry in entries:
+                        syntax = entry.get('syntax') if isinstance(entry, dict) else entry
+                        if not isinstance(syntax, str):
+                            raise ValueError(f"{path} : each reaction must be a string or an object with a \"syntax\" string")
+                        lines.append(syntax)
+                else:
+                    lines += f.read().splitlines()
+        return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+    def get_layout_cache(self):
+        """Return the on-disk layout cache, or None if it is disabled or unusable."""
+        if self.layout_cache is None:
+            self.layout_cache = False
+            if self.options.gen_cache or self.options.gen_cache_clear:
+                from feynman_cache import LayoutCache
+                try:
+                    cache = LayoutCache(max_bytes=self.options.gen_cache_size * 1024 * 1024)
+                    cache.connect()
+                    if self.options.gen_cache_clear:
+                        cache.clear()
+                    if self.options.gen_cache:
+                        self.layout_cache = cache
+                except (OSError, sqlite3.Error) as e:
+                    inkex.errormsg(f"Layout cache disabled : {str(e)}")
+        return self.layout_cache or None
+
+    def compute_geometry(self, syntax : str):
+        """Compute the layout of a reaction with pyfeyngen, or read it from the layout cache."""
+        with self.stats.phase('import_pyfeyngen'):
+            import pyfeyngen
+        cache = self.get_layout_cache()
+        if cache is not None:
+            key = cache.key(syntax, self.options.gen_x_spacing, self.options.gen_y_spacing,
+                            getattr(pyfeyngen, '__version__', ''))
+            try:
+                with self.stats.phase('layout_cache'):
+                    data = cache.get(key)
+                if data is not None: return data
+            except (OSError, sqlite3.Error):
+                cache = None
+
+        with self.stats.phase('quick_geometry'):
+            data = pyfeyngen.quick_geometry(syntax, self.options.gen_x_spacing, self.options.gen_y_spacing)
+        if 'error' in data:
+            raise ValueError(data['error'])
+        if cache is not None:
+            try:
+                with self.stats.phase('layout_cache'):
+                    cache.put(key, data)
+            except (OSError, sqlite3.Error):
+                pass
+        return data
+
+    def report_error(self, error, x=50, y=50, parent=None, syntax=None):
+        """Report a generation error, either as a red label in the document (quiet mode) or as an Inkscape message."""
+        self.generation_errors.append((syntax, error))
+        if self.options.quiet_error:
+            label = inkex.TextElement()
+            lid = self.get_unique_id("label")
+            label.set('id', lid)
+            self.register_element(label)
+            label.text = f"Error : {str(error)}"
+            label.set('x', str(x))
+            label.set('y', str(y))
+            label.style = {
+                'font-size': '12px',
+                'fill': 'red',
+                'text-anchor': 'middle',
+                'dominant-baseline': 'middle',
+                'font-family': 'sans-serif'
+            }
+            (parent if parent is not None else self.svg.get_current_layer()).add(label)
+        elif syntax is not None:
+            inkex.errormsg(f"Error/Warning when generating '{syntax}' : {str(error)}")
+        else:
+            inkex.errormsg(f"Error/Warning when generating : {str(error)}")
+
+    @timed('generate_batch')
+    def generate_batch(self, syntaxes):
+        """Generate several reactions into the document, one group per diagram, laid out on a grid."""
+        results = []
+        for syntax in syntaxes:
+            try:
+                results.append((syntax, self.compute_geometry(syntax), None))
+            except Exception as e:
+                results.append((syntax, None, e))
+
+        cell = self.grid_cell([self.diagram_extent(data) for _, data, _ in results if data is not None])
+        layer = self.svg.get_current_layer()
+        for i, (syntax, data, error) in enumerate(results):
+            x0, y0 = self.grid_origin(i, cell)
+            if error is None:
+                group = self.add_diagram_group(syntax, layer)
+                try:
+                    min_x, min_y, _, _ = self.diagram_extent(data)
+                    self.generate_diagram(data, parent=group, origin=(x0 - min_x, y0 - min_y))
+                    continue
+                except Exception as e:
+                    error = e
+                    self.delete_element(group)
+            self.report_error(error, x0, y0, layer, syntax)
+
+    def diagram_extent(self, data):
+        """Return (min x, min y, width, height) of the nodes of a pyfeyngen geometry, at the diagram scale."""
+        if not data['nodes']: return 0, 0, 0, 0
+        scale = self.options.gen_scale
+        xs = [n['x'] * scale for n in data['nodes'].values()]
+        ys = [n['y'] * scale for n in data['nodes'].values()]
+        return min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)
+
+    def grid_cell(self, extents):
+        """Return the size of a batch grid cell: all cells share the size of the largest diagram."""
+        cell_w = max((e[2] for e in extents), default=0) + self.options.gen_batch_spacing
+        cell_h = max((e[3] for e in extents), default=0) + self.options.gen_batch_spacing
+        return cell_w, cell_h
+
+    def grid_origin(self, index : int, cell):
+        """Return the top-left corner of the grid cell of the index-th diagram of a batch."""
+        row, col = divmod(index, max(1, self.options.gen_columns))
+        return 50 + col * cell[0], 50 + row * cell[1]
+
+    def add_diagram_group(self, syntax : str, parent):
+        """Create the group holding one diagram of a batch."""
+        group = Group()
+        group.set('id', self.get_unique_id("diagram"))
+        group.label = syntax
+        self.register_element(group)
+        parent.add(group)
+        return group
+
+    def style_from_options(self):
+        """Return the style selected in the extension dialog."""
+        return FeynmanStyle(**{field: getattr(self.options, field) for field in FeynmanStyle._fields})
+
+    @timed('style_path')
+    def style_path(self, elem:inkex.PathElement, style:FeynmanStyle):
+        """Apply the Builder settings to a path. Only the parts (line, vertices, arrow, momentum)
+            whose settings or geometry changed since the last run are redone."""
+        old = self.read_fingerprint(elem)
+        new = self.path_fingerprint(elem, style)
+        if style.p_type == "no_change":
+            new['line'] = old.get('line', '')
+        if old == new and not self.has_missing_link(elem, style): return
+
+        if new['line'] != old.get('line') and style.p_type != "no_change":
+            self.reset_path(elem)
+            self.apply_particle_lpe(elem, style)
+
+        vertex_links = ('data-feynman-vertices',)
+        if new['vertex'] != old.get('vertex') or self.has_missing_link(elem, style, vertex_links):
+            self.remove_linked_ghost(elem, vertex_links)
+            self.apply_vertices(elem, style)
+
+        arrow_links = ('data-feynman-ghost',)
+        if new['arrow'] != old.get('arrow') or self.has_missing_link(elem, style, arrow_links):
+            self.remove_linked_ghost(elem, arrow_links)
+            if style.arrow_type != "none":
+                direction = self.get_arrow_direction(elem, style.arrow_type)
+                self.apply_separate_arrow(elem, style._replace(arrow_type=direction))
+
+        momentum_links = ('data-feynman-ghost-arrow', 'data-feynman-label')
+        if new['momentum'] != old.get('momentum') or self.has_missing_link(elem, style, momentum_links):
+            self.remove_linked_ghost(elem, momentum_links)
+            if style.momentum_arrow != "none" or style.momentum_label:
+                direction = self.get_arrow_direction(elem, style.momentum_arrow)
+                self.apply_momentum_flow(elem, style._replace(momentum_arrow=direction))
+
+        elem.set(self.FINGERPRINT_ATTRIBUTE, ';'.join(f"{part}:{value}" for part, value in new.items()))
+
+    def path_fingerprint(self, elem:inkex.PathElement, style:FeynmanStyle):
+        """Return a short hash of the settings (and geometry) of each part of a styled path."""
+        o = style
+        record = self.path_geometry(elem)
+        geometry = (str(record.skeleton), str(record.transform))
+        stroke = elem.style.get('stroke', 'black')
+        parts = {
+            'line': (o.p_type, o.amplitude, o.propagator_mode, geometry if o.propagator_mode != "live" else None),
+            'vertex': (o.v_style, o.v_size, o.v_location, o.v_apply_all, stroke, geometry),
+            'arrow': (o.arrow_type, stroke, geometry),
+            'momentum': (o.momentum_arrow, o.momentum_label, o.momentum_offset, o.momentum_length,
+                         o.label_latex, stroke, geometry),
+        }
+        return {part: hashlib.sha1(repr(value).encode('utf-8')).hexdigest()[:12] for part, value in parts.items()}
+
+    def read_fingerprint(self, elem:inkex.PathElement):
+        """Return the fingerprint stored on a path by the last run, or an empty dict."""
+        value = elem.get(self.FINGERPRINT_ATTRIBUTE)
+        if not value: return {}
+        return dict(item.split(':', 1) for item in value.split(';') if ':' in item)
+
+    def has_missing_link(self, elem:inkex.PathElement, style:FeynmanStyle, attrs=LINK_ATTRIBUTES):
+        """Return True if a ghost, momentum arrow or label required by the settings is missing
+            (for example deleted by hand)."""
+        wanted = {
+            'data-feynman-ghost': style.arrow_type != "none",
+            'data-feynman-ghost-arrow': style.momentum_arrow != "none",
+            'data-feynman-label': bool(style.momentum_label),
+            # No group is linked to a path without nodes
+            'data-feynman-vertices': style.v_style != "none" and elem.get('data-feynman-vertices') is not None,
+        }
+        return any(wanted[attr] and self.get_element(elem.get(attr, '')) is None for attr in attrs)
+
+    def get_skeleton_path(self, elem:inkex.PathElement):
+        """Return the path as drawn by the user: the input of its path effect if it has one."""
+        NS_INK = "http://www.inkscape.org/namespaces/inkscape"
+        original_d = elem.get(f"{{{NS_INK}}}original-d")
+        return inkex.Path(original_d) if original_d else elem.path
+
+    @timed('remove_linked_ghost')
+    def remove_linked_ghost(self,  elem:inkex.PathElement, attrs=LINK_ATTRIBUTES):
         """Remove ghost, momemtum arrow and label"""
-        for attr in ['data-feynman-ghost', 'data-feynman-ghost-arrow', 'data-feynman-label']:
+        for attr in attrs:
             ghost_id = elem.get(attr)
             if ghost_id:
-                ghost_elem = self.svg.getElementById(ghost_id)
+                ghost_elem = self.get_element(ghost_id)
                 if ghost_elem is not None:
-                    ghost_elem.delete()
+                    self.delete_element(ghost_elem)
+                # The ID may be given to another element later
+                del elem.attrib[attr]
 
     def reset_path(self, elem:inkex.PathElement):
         """Reset the path element to its original path data and remove any applied path effects."""
@@ -117,30 +517,28 @@ class FeynmanLogic(inkex.EffectExtension):
                 del elem.attrib[f"{{{NS_INK}}}path-effect"]
             del elem.attrib[f"{{{NS_INK}}}original-d"]
 
-    def apply_separate_arrow(self, elem:inkex.PathElement):
+    @timed('apply_separate_arrow')
+    def apply_separate_arrow(self, elem:inkex.PathElement, style:FeynmanStyle):
         """Apply a separate arrow marker to the path element by adding a new path"""
-        if self.options.arrow_type == "none":
+        if style.arrow_type == "none":
             return
 
-        path_instance = elem.path.transform(elem.composed_transform())
-        csp = path_instance.to_superpath()
-
-        if len(csp[0]) >= 2:
-            # Extract the four key points of the cubic Bezier: start, first control, second control, end
-            p0, h0, h1, p1 = csp[0][0][1], csp[0][0][2], csp[0][-1][0], csp[0][-1][1]
-            # Use De Casteljau's algorithm to find the midpoint and control points
-            q0, mid_p, q1 = self.casteljau_midpoint(p0, h0, h1, p1)
-            # Insert a new segment at the midpoint to allow for a separate arrow marker
-            csp[0].insert(1, [q0, mid_p, q1])
+        # Middle of the path (half of its length, whatever its number of nodes) and tangent there,
+        # in the coordinates of the parent, where the ghost is added
+        frame = self.path_geometry(elem).frame
+        if frame is None: return
+        (mx, my), (ux, uy), _ = frame
 
         ghost = PathElement()
-        new_ghost_id = self.svg.get_unique_id("ghost")
+        new_ghost_id = self.get_unique_id("ghost")
         ghost.set('id', new_ghost_id)
-        ghost.set('d', str(inkex.Path(inkex.CubicSuperPath(csp))))
+        self.register_element(ghost)
+        # A short segment along the tangent: its middle node carries the arrow marker
+        ghost.set('d', self.format_path([('M', (mx - ux, my - uy)), ('L', (mx, my)), ('L', (mx + ux, my + uy))]))
         
         elem.set('data-feynman-ghost', new_ghost_id)
         
-        marker_id = self.ensure_arrow_marker()
+        marker_id = self.ensure_arrow_marker(style)
         ghost.style = {
             'fill': 'none',
             'stroke': elem.style.get('stroke', 'black'),
@@ -152,24 +550,14 @@ class FeynmanLogic(inkex.EffectExtension):
 
         elem.getparent().add(ghost)
 
-    def apply_particle_lpe(self, elem:inkex.PathElement):
+    @timed('apply_particle_lpe')
+    def apply_particle_lpe(self, elem:inkex.PathElement, style:FeynmanStyle):
         """Apply the appropriate Live Path Effect (LPE) or 
             style to the path element based on particle type."""
-        p_type = self.options.p_type
+        p_type = style.p_type
         if p_type == "fermion": return
         NS_INK = "http://www.inkscape.org/namespaces/inkscape"
         pattern_info = self.patterns.get(p_type, {"d": "m 0,0 h 10", "normal_offset": 0}) 
-        pattern_id = self.ensure_pattern(p_type)
-        lpe_id = self.svg.get_unique_id("lpe")
-        lpe_node = inkex.etree.SubElement(self.svg.defs, f"{{{NS_INK}}}path-effect")
-        lpe_node.set('id', lpe_id)
-        lpe_node.set('effect', 'skeletal')
-        lpe_node.set('pattern', '#' + pattern_id)
-        lpe_node.set('copytype', 'repeated_stretched')
-        lpe_node.set('width', str(self.options.amplitude))
-        lpe_node.set('normal_offset', str(pattern_info["normal_offset"]))
-        lpe_node.set('is_fittopath', 'true')
-        lpe_node.set('is_upper_case', 'true')
 
         # --- DASHED/DOTTED LINE MANAGEMENT ---
         if "dash" in pattern_info:
@@ -180,66 +568,198 @@ class FeynmanLogic(inkex.EffectExtension):
 
         if p_type in ["scalar", "ghost", "fermion"]:
             # For these types, do not apply LPE, just set the line style
+            self.ensure_pattern(p_type)
             elem.attrib[f"{{{NS_INK}}}original-d"] = elem.get("d")
             return
 
         elem.attrib[f"{{{NS_INK}}}original-d"] = elem.get("d")
-        elem.set(f"{{{NS_INK}}}path-effect", "#" + lpe_id)
+        if style.propagator_mode != "baked":
+            lpe_id = self.ensure_lpe(self.ensure_pattern(p_type), style.amplitude, pattern_info["normal_offset"])
+            elem.set(f"{{{NS_INK}}}path-effect", "#" + lpe_id)
+        if style.propagator_mode != "live":
+            self.bake_particle(elem, style)
+
+    def get_pattern_tile(self, p_type : str, amplitude):
+        """Return the (cached) tile of a particle pattern at the given amplitude:
+            (segments, tile length, normal offset), with the pattern height scaled to the amplitude."""
+        key = (p_type, amplitude)
+        tile = self.pattern_tiles.get(key)
+        if tile is None:
+            info = self.patterns.get(p_type, {"d": "m 0,0 h 10", "normal_offset": 0})
+            segments, width, height = pattern_tile(inkex.Path(info["d"]).to_superpath())
+            segments[..., 1] *= amplitude
+            tile = self.pattern_tiles[key] = (segments, width, info["normal_offset"] * amplitude / height)
+        return tile
+
+    @timed('bake_particle')
+    def bake_particle(self, elem:inkex.PathElement, style:FeynmanStyle):
+        """Write the pattern repeated along the path as static path data, readable without the LPE.
+            The skeleton stays in inkscape:original-d, so the path can be styled again."""
+        segments, tile_length, offset = self.get_pattern_tile(style.p_type, style.amplitude)
+        baked = bake_pattern(self.path_geometry(elem).skeleton.to_superpath(), segments, tile_length, offset)
+        if baked is None: return
+        commands = [('M', baked[0, 0])]
+        previous = baked[0, 0]
+        for segment in baked:
+            if abs(segment[0] - previous).max() > 1e-6:
+                commands.append(('L', segment[0]))
+            commands.append(('C', *segment[1:]))
+            previous = segment[3]
+        elem.set('d', self.format_path(commands))
+
+    def lpe_key(self, lpe_node):
+        """Return the cache key of a skeletal LPE using one of our patterns, or None for any other effect."""
+        pattern = lpe_node.get('pattern', '')
+        if lpe_node.get('effect') != 'skeletal' or not pattern.startswith('#fref_'):
+            return None
+        return (pattern[1:], lpe_node.get('width'), lpe_node.get('normal_offset'), lpe_node.get('copytype'))
+
+    @timed('ensure_lpe')
+    def ensure_lpe(self, pattern_id : str, width, normal_offset, copytype = 'repeated_stretched'):
+        """Ensure a skeletal LPE with these parameters exists, and return its ID.
+            Identical propagators share the same definition."""
+        if self.id_index is None: self.index_document()
+        key = (pattern_id, str(width), str(normal_offset), copytype)
+        lpe_id = self.lpe_cache.get(key)
+        if lpe_id is not None and lpe_id in self.id_index: return lpe_id
 
-    def apply_vertices(self, elem:inkex.PathElement):
-        """Apply vertex markers to the path element based on the selected style and location."""
-        v_style, v_loc = self.options.v_style, self.options.v_location
-        elem.style['marker-start'] = elem.style['marker-end'] = elem.style['marker-mid'] = 'none'
-        if v_style == "none": return
-        marker_url = f"url(#{self.ensure_vertex_marker(v_style)})"
-
-        start, end = self.get_start_end_from_elem(elem)
-        x1, y1 = start
-        x2, y2 = end
+        NS_INK = "http://www.inkscape.org/namespaces/inkscape"
+        lpe_id = self.get_unique_id("lpe")
+        lpe_node = inkex.etree.SubElement(self.svg.defs, f"{{{NS_INK}}}path-effect")
+        lpe_node.set('id', lpe_id)
+        self.register_element(lpe_node)
+        lpe_node.set('effect', 'skeletal')
+        lpe_node.set('pattern', '#' + pattern_id)
+        lpe_node.set('copytype', copytype)
+        lpe_node.set('width', key[1])
+        lpe_node.set('normal_offset', key[2])
+        lpe_node.set('is_fittopath', 'true')
+        lpe_node.set('is_upper_case', 'true')
+        self.lpe_cache[key] = lpe_id
+        return lpe_id
 
-        if v_loc == "both": elem.style['marker-start'] = elem.style['marker-end'] = marker_url
-        elif v_loc == "start": elem.style['marker-start'] = marker_url
-        elif v_loc == "end": elem.style['marker-end'] = marker_url
-        elif v_loc == "left": elem.style['marker-start' if x1 < x2 else 'marker-end'] = marker_url
-        elif v_loc == "right": elem.style['marker-start' if x1 > x2 else 'marker-end'] = marker_url
-        elif v_loc == "up": elem.style['marker-start' if y1 < y2 else 'marker-end'] = marker_url
-        elif v_loc == "down": elem.style['marker-start' if y1 > y2 else 'marker-end'] = marker_url
+    @timed('compact_defs')
+    def compact_defs(self):
+        """Collapse duplicate LPEs created by the extension into one shared definition
+            and remove the ones no longer used by any path."""
+        NS_INK = "http://www.inkscape.org/namespaces/inkscape"
+        canonical, remap, nodes = {}, {}, {}
+        for node in list(self.svg.iter(f"{{{NS_INK}}}path-effect")):
+            key = self.lpe_key(node)
+            if key is None or node.get('id') is None: continue
+            nodes[node.get('id')] = node
+            remap[node.get('id')] = canonical.setdefault(key, node.get('id'))
+
+        # Point every path at the canonical definition
+        used = set()
+        for elem in self.svg.iter(inkex.etree.Element):
+            effects = elem.get(f"{{{NS_INK}}}path-effect")
+            if not effects: continue
+            refs = [ref.strip() for ref in effects.split(';')]
+            refs = ['#' + remap.get(ref[1:], ref[1:]) if ref.startswith('#') else ref for ref in refs]
+            used.update(ref[1:] for ref in refs if ref.startswith('#'))
+            elem.set(f"{{{NS_INK}}}path-effect", ';'.join(refs))
+
+        for lpe_id, target in remap.items():
+            if lpe_id != target or lpe_id not in used:
+                self.delete_element(nodes[lpe_id])
+        self.lpe_cache = {key: lpe_id for key, lpe_id in canonical.items() if lpe_id in used}
+
+    @timed('apply_vertices')
+    def apply_vertices(self, elem:inkex.PathElement, style:FeynmanStyle):
+        """Draw the vertices of the path element (its ends, chosen by location, or all its nodes)
+            as one group of shared symbols, next to it."""
+        # Vertices were markers of the path in previous versions
+        elem.style['marker-start'] = elem.style['marker-end'] = elem.style['marker-mid'] = 'none'
+        if style.v_style == "none": return
 
+        record = self.path_geometry(elem)
+        if record.start is None: return
+        if style.v_apply_all:
+            nodes = [node[1] for sub in record.superpath for node in sub]
+        else:
+            v_loc = style.v_location
+            (x1, y1), (x2, y2) = record.start, record.end
+            if v_loc == "both": nodes = [(x1, y1), (x2, y2)]
+            elif v_loc == "start": nodes = [(x1, y1)]
+            elif v_loc == "end": nodes = [(x2, y2)]
+            elif v_loc == "left": nodes = [(x1, y1) if x1 < x2 else (x2, y2)]
+            elif v_loc == "right": nodes = [(x1, y1) if x1 > x2 else (x2, y2)]
+            elif v_loc == "up": nodes = [(x1, y1) if y1 < y2 else (x2, y2)]
+            elif v_loc == "down": nodes = [(x1, y1) if y1 > y2 else (x2, y2)]
+            else: nodes = []
+
+        parent = elem.getparent()
+        group = self.add_vertices(nodes, style, elem.style.get('stroke', 'black'), parent, self.composed_transform(parent))
+        if group is not None:
+            elem.addnext(group)
+            elem.set('data-feynman-vertices', group.get('id'))
+
+    def add_vertices(self, points, style:FeynmanStyle, color, parent, transform):
+        """Add a group of vertex symbols at points (in the coordinates of parent, placed in the document
+            by transform) to parent, one per position. Returns the group, or None without points.
+            Each path has its own group, so that restyling one path never changes the vertices of another."""
+        symbol_id = self.ensure_vertex_symbol(style)
+        group = None
+        positions = set()
+        for x, y in points:
+            doc = transform.apply_to_point((x, y))
+            key = (round(doc.x, 3), round(doc.y, 3))
+            if key in positions: continue
+            positions.add(key)
+            if group is None:
+                group = Group()
+                group.set('id', self.get_unique_id("vertices"))
+                self.register_element(group)
+                group.style = {'fill': color, 'stroke': 'none'}
+                parent.add(group)
+            use = Use()
+            use.set('xlink:href', f"#{symbol_id}")
+            # Placed by a transform rather than x/y, which inkex leaves out of bounding boxes
+            self.set_transform(use, f"translate({self.format_number(x)},{self.format_number(y)})")
+            group.add(use)
+            self.stats.count('vertices')
+        return group
+
+    @timed('ensure_pattern')
     def ensure_pattern(self, p_type : str):
         """Ensure the SVG pattern for the given particle type exists, and return its ID."""
         p_id = f"fref_{p_type}"
-        if self.svg.getElementById(p_id) is not None: return p_id
+        if self.find_def(p_id) is not None: return p_id
         info = self.patterns.get(p_type, {"d": "m 0,0 h 10"})
         new_p = PathElement()
         new_p.set('d', info["d"]); new_p.set('id', p_id)
         new_p.style = {'stroke': 'black', 'stroke-width': '1', 'fill': 'none'}
-        self.svg.defs.add(new_p); return p_id
-
-    def ensure_vertex_marker(self, v_style : str):
-        """Ensure the SVG marker for the given vertex style exists, and return its ID."""
-        m_id = f"fmarker_{v_style}_{self.options.v_size}"
-        if self.svg.getElementById(m_id) is not None: return m_id
-        size = self.options.v_size
-        marker = Marker()
-        marker.set('id', m_id); marker.set('orient', 'auto'); marker.set('markerUnits', 'userSpaceOnUse')
+        self.svg.defs.add(new_p); self.register_element(new_p); return p_id
+
+    @timed('ensure_vertex_symbol')
+    def ensure_vertex_symbol(self, style:FeynmanStyle):
+        """Ensure the SVG symbol for the given vertex style and size exists, and return its ID."""
+        v_style = style.v_style
+        s_id = f"fvertex_{v_style}_{style.v_size}"
+        if self.find_def(s_id) is not None: return s_id
+        size = style.v_size
+        symbol = Symbol()
+        symbol.set('id', s_id); symbol.style = {'overflow': 'visible'}
         if v_style in ["dot", "blob"]:
             r = size if v_style == "dot" else size * 2.5
             shape = Circle(cx="0", cy="0", r=str(r))
         else:
             shape = Rectangle(x=str(-size), y=str(-size), width=str(size*2), height=str(size*2))
-        shape.style = {'fill': 'context-stroke', 'stroke': 'none'}
-        marker.add(shape); self.svg.defs.add(marker); return m_id
+        # The fill is inherited from the <use> group, in the color of the path
+        symbol.add(shape); self.svg.defs.add(symbol); self.register_element(symbol); return s_id
 
-    def ensure_arrow_marker(self, momentum = False):
+    @timed('ensure_arrow_marker')
+    def ensure_arrow_marker(self, style:FeynmanStyle, momentum = False):
         """Ensure the SVG marker for the arrow (or momentum arrow) exists, and return its ID."""
         if momentum:
             type = 'forward'
-            m_id = f"farrow_momentum_{self.options.momentum_arrow}"
+            m_id = f"farrow_momentum_{style.momentum_arrow}"
         else:
-            type = self.options.arrow_type
-            m_id = f"farrow_{self.options.arrow_type}"
+            type = style.arrow_type
+            m_id = f"farrow_{style.arrow_type}"
 
-        if self.svg.getElementById(m_id) is not None: return m_id
+        if self.find_def(m_id) is not None: return m_id
         marker = Marker()
         marker.set('id', m_id); marker.set('orient', 'auto')
         marker.set('refX', '5'); marker.set('refY', '4')
@@ -251,43 +771,43 @@ class FeynmanLogic(inkex.EffectExtension):
 
         arrow = PathElement(); arrow.set('d', d)
         arrow.style = {'fill': 'context-stroke', 'stroke': 'none'}
-        marker.add(arrow); self.svg.defs.add(marker); return m_id
+        marker.add(arrow); self.svg.defs.add(marker); self.register_element(marker); return m_id
 
-    def apply_momentum_flow(self, elem:inkex.PathElement):
+    @timed('apply_momentum_flow')
+    def apply_momentum_flow(self, elem:inkex.PathElement, style:FeynmanStyle):
         """Draw a momentum flow arrow and/or label near the path element."""
-        # 1. Compute base geometry (needed for both arrow and label)
-        path_instance = elem.path.transform(elem.composed_transform())
-        csp = path_instance.to_superpath()
-        if len(csp[0]) < 2: return
-
-        # Extract the four key points of the cubic Bezier: start, first control, second control, end
-        p0, c0, c1, p1 = csp[0][0][1], csp[0][0][2], csp[0][-1][0], csp[0][-1][1]
-        # Use De Casteljau's algorithm to find the midpoint and control points
-        q1, mid_p, q2 = self.casteljau_midpoint(p0, c0, c1, p1)
-
-        # Compute the tangent vector at the midpoint
-        tx, ty = q2[0] - q1[0], q2[1] - q1[1]
-        t_len = (tx**2 + ty**2)**0.5
-        if t_len == 0: return  # Avoid division by zero if tangent is degenerate
-        ux, uy = tx/t_len, ty/t_len  # Unit tangent vector
-        nx, ny = -uy, ux  # Unit normal vector (perpendicular to tangent)
+        # 1. Base geometry (needed for both arrow and label), in the coordinates of the parent:
+        # middle of the path (half of its length), unit tangent and unit normal there
+        frame = self.path_geometry(elem).frame
+        if frame is None: return  # Degenerate path
+        mid_p, (ux, uy), (nx, ny) = frame
+
+        a_len, offset, shift = style.momentum_length, style.momentum_offset, 0.0
+        placer = self.get_label_placer()
+        if placer is not None:
+            # Move the arrow and label together to the nearest free position
+            # The placer works in document coordinates
+            transform = self.composed_transform(elem.getparent())
+            offset, shift = placer.place(lambda o, t: [self.transform_box(transform, box) for box in
+                                                       self.momentum_boxes(mid_p, (ux, uy), (nx, ny), style, o, t)], offset)
+        mid_p = (mid_p[0] + ux * shift, mid_p[1] + uy * shift)
 
         # 2. DRAW THE ARROW (if enabled)
-        if self.options.momentum_arrow != "none":
-            a_len, offset = self.options.momentum_length, self.options.momentum_offset
+        if style.momentum_arrow != "none":
             ax, ay = mid_p[0] + (nx * offset) - (ux * a_len/2), mid_p[1] + (ny * offset) - (uy * a_len/2)
             bx, by = mid_p[0] + (nx * offset) + (ux * a_len/2), mid_p[1] + (ny * offset) + (uy * a_len/2)
 
             flow_ghost = PathElement()
-            fid = self.svg.get_unique_id("flow")
+            fid = self.get_unique_id("flow")
             flow_ghost.set('id', fid)
+            self.register_element(flow_ghost)
 
-            if self.options.momentum_arrow == "forward":
-                flow_ghost.set('d', f"M {ax},{ay} L {bx},{by}")
+            if style.momentum_arrow == "forward":
+                flow_ghost.set('d', self.format_path([('M', (ax, ay)), ('L', (bx, by))]))
             else:
-                flow_ghost.set('d', f"M {bx},{by} L {ax},{ay}")
+                flow_ghost.set('d', self.format_path([('M', (bx, by)), ('L', (ax, ay))]))
 
-            mid = self.ensure_arrow_marker(momentum=True)
+            mid = self.ensure_arrow_marker(style, momentum=True)
             flow_ghost.style = {
                 'fill': 'none', 
                 'stroke': elem.style.get('stroke', 'black'), 
@@ -299,31 +819,22 @@ class FeynmanLogic(inkex.EffectExtension):
             elem.set('data-feynman-ghost-arrow', fid)
 
         # 3. DRAW THE LABEL (independent of the arrow)
-        if self.options.momentum_label:
+        if style.momentum_label:
             label = inkex.TextElement()
-            lid = self.svg.get_unique_id("label")
+            lid = self.get_unique_id("label")
             label.set('id', lid)
+            self.register_element(label)
 
-            # Compute angle for label orientation
-            angle = math.degrees(math.atan2(ty, tx))
-            if angle > 90:
-                angle -= 180
-            if angle < -90:
-                angle += 180
-
-            # If the arrow is not present, reduce the offset
-            # so the text is closer to the propagator
-            current_offset = self.options.momentum_offset
-            text_margin = 8 if self.options.momentum_arrow != "none" else 5
-            t_off = current_offset + (text_margin if current_offset >= 0 else -text_margin)
-
+            angle = self.label_angle(ux, uy)
+            t_off = self.label_offset(style, offset)
             lx, ly = mid_p[0] + (nx * t_off), mid_p[1] + (ny * t_off)
 
-            label.set('transform', f"translate({lx},{ly}) rotate({angle})")
-            if self.options.label_latex:
-                label.text = '$'+ self.options.momentum_label + '$'
+            fmt = self.format_number
+            self.set_transform(label, f"translate({fmt(lx)},{fmt(ly)}) rotate({fmt(angle)})")
+            if style.label_latex:
+                label.text = '$'+ style.momentum_label + '$'
             else:
-                label.text = self.options.momentum_label
+                label.text = style.momentum_label
             label.style = {
                 'font-size': '10px', 
                 'text-anchor': 'middle', 
@@ -334,6 +845,106 @@ class FeynmanLogic(inkex.EffectExtension):
             elem.addnext(label)
             elem.set('data-feynman-label', lid)
 
+    def label_angle(self, ux, uy):
+        """Return the angle (degrees) of a label along the tangent (ux, uy), kept upright: in [-90, 90),
+            so that vertical labels always read upwards, whatever the rounding of the tangent."""
+        angle = math.degrees(math.atan2(uy, ux))
+        if angle >= 90 - 1e-6:
+            angle -= 180
+        elif angle < -90 - 1e-6:
+            angle += 180
+        return angle
+
+    def label_offset(self, style:FeynmanStyle, offset):
+        """Return the distance from the path to the label, for a momentum arrow at offset."""
+        # If the arrow is not present, reduce the offset
+        # so the text is closer to the propagator
+        text_margin = 8 if style.momentum_arrow != "none" else 5
+        return offset + (text_margin if offset >= 0 else -text_margin)
+
+    def momentum_boxes(self, mid_p, tangent, normal, style:FeynmanStyle, offset, shift):
+        """Return the boxes of the momentum arrow and label of a path, at the given
+            normal offset and shift along the tangent from its middle."""
+        (ux, uy), (nx, ny) = tangent, normal
+        cx, cy = mid_p[0] + ux * shift, mid_p[1] + uy * shift
+        boxes = []
+        if style.momentum_arrow != "none":
+            half = style.momentum_length / 2
+            boxes.append(segment_box((cx + nx * offset - ux * half, cy + ny * offset - uy * half),
+                                     (cx + nx * offset + ux * half, cy + ny * offset + uy * half), 2.0))
+        if style.momentum_label:
+            t_off = self.label_offset(style, offset)
+            text = f"${style.momentum_label}$" if style.label_latex else style.momentum_label
+            boxes.append(text_box(cx + nx * t_off, cy + ny * t_off, self.label_angle(ux, uy), text))
+        return boxes
+
+    def transform_box(self, transform, box):
+        """Return the bounding box of a box (x0, y0, x1, y1) moved by transform."""
+        corners = [transform.apply_to_point(p) for p in ((box[0], box[1]), (box[2], box[1]), (box[0], box[3]), (box[2], box[3]))]
+        return (min(p.x for p in corners), min(p.y for p in corners), max(p.x for p in corners), max(p.y for p in corners))
+
+    def get_label_placer(self):
+        """Return the placer of the momentum labels of this run, or None if overlaps are not avoided."""
+        if self.label_placer is None and self.options.avoid_overlaps:
+            self.label_placer = LabelPlacer()
+        return self.label_placer
+
+    def seed_label_placer(self, paths, style:FeynmanStyle):
+        """Add to the label placer, before the selected paths are styled, every path of their layers
+            and the momentum labels and arrows which this run keeps: those of the other paths, and
+            of the selected paths whose momentum part is unchanged."""
+        layers = {}
+        for elem in paths:
+            layer = next((node for node in elem.iterancestors() if isinstance(node, inkex.Layer)), self.svg)
+            layers[id(layer)] = layer
+        selected = set(paths)
+        momentum_links = ('data-feynman-ghost-arrow', 'data-feynman-label')
+        for layer in layers.values():
+            for elem in layer.iter(inkex.addNS('path', 'svg')):
+                feynman = elem.get(self.FINGERPRINT_ATTRIBUTE) is not None
+                if elem in selected:
+                    self.add_obstacle_path(elem, style)
+                    # Labels redone in this run are placed again
+                    feynman = feynman and not self.momentum_outdated(elem, style)
+                elif feynman:
+                    self.add_obstacle_path(elem, style._replace(p_type="no_change"))
+                if not feynman: continue
+                for attr in momentum_links:
+                    linked = self.get_element(elem.get(attr, ''))
+                    if linked is not None: self.add_obstacle_element(linked)
+
+    def momentum_outdated(self, elem:inkex.PathElement, style:FeynmanStyle):
+        """Return True if style_path will redo the momentum arrow and label of a path."""
+        old = self.read_fingerprint(elem).get('momentum')
+        return old != self.path_fingerprint(elem, style)['momentum'] or \
+            self.has_missing_link(elem, style, ('data-feynman-ghost-arrow', 'data-feynman-label'))
+
+    def add_obstacle_element(self, elem):
+        """Add a momentum label or arrow already in the document to the obstacles of the label placer."""
+        parent = elem.getparent()
+        # Read without elem.transform, which would write the attribute again as a matrix
+        transform = self.composed_transform(parent) @ inkex.Transform(inkex.etree.ElementBase.get(elem, 'transform'))
+        if isinstance(elem, inkex.TextElement):
+            box = text_box(0.0, 0.0, 0.0, ''.join(elem.itertext()))
+            self.label_placer.add_box(self.transform_box(transform, box))
+        elif isinstance(elem, inkex.PathElement):
+            points = [transform.apply_to_point(point) for point in elem.path.end_points]
+            if points: self.label_placer.add_box(segment_box(points[0], points[-1], 2.0))
+
+    def add_obstacle_path(self, elem:inkex.PathElement, style:FeynmanStyle):
+        """Add a path to the obstacles of the label placer, widened by the amplitude of wavy lines."""
+        record = self.path_geometry(elem)
+        self.add_obstacle(record.skeleton.transform(record.transform).to_superpath(), style)
+
+    def add_obstacle(self, csp, style:FeynmanStyle):
+        """Add a CubicSuperPath in document coordinates to the obstacles of the label placer."""
+        table = arc_length_table(csp)
+        if table is None: return
+        pad = style.amplitude / 2 + 1 if style.p_type in ("photon", "gluon", "boson") else 1.0
+        # Five points per segment are close enough for boxes of a cell
+        points = table.samples[:, ::8].reshape(-1, 2).tolist()
+        self.label_placer.add_polyline(points, pad)
+
     def get_arrow_direction(self, elem:inkex.PathElement, orientation : str):
         """
         Determine if the marker should be 'forward' (A->B) or 'backward' (B->A)
@@ -369,127 +980,151 @@ class FeynmanLogic(inkex.EffectExtension):
 
         return "forward"
 
-    def generate_diagram(self, data):
-        """ Generate the diagram from pyfeyngen data.
-            Uses markers for vertices with anti-duplication logic."""
-        layer = self.svg.get_current_layer()
-        scale = 1.0
-        offset_x, offset_y = 50, 50
+    @timed('edge_geometry')
+    def batch_geometry(self, edges, offset_x, offset_y):
+        """Return the geometry of pyfeyngen edges, computed for all of them at once: per edge, its
+            (start, control point, end, bent, middle, unit tangent) (see edge_geometry)."""
+        geometry = edge_geometry([edge['start'] for edge in edges], [edge['end'] for edge in edges],
+                                 [edge.get('bend', 0.0) for edge in edges], (offset_x, offset_y), self.options.precision)
+        return list(zip(*(array.tolist() for array in geometry)))
+
+    def edge_superpath(self, geometry):
+        """Return the CubicSuperPath of an edge from its geometry, with the same nodes and handles
+            as the to_superpath() of its path."""
+        p0, control, p2, bent = geometry[:4]
+        if not bent: return [[[p0, p0, p0], [p2, p2, p2]]]
+        (a, b), (c, d), (e, f) = p0, control, p2
+        return [[[p0, p0, [a + 2 * (c - a) / 3, b + 2 * (d - b) / 3]], [[e + 2 * (c - e) / 3, f + 2 * (d - f) / 3], p2, p2]]]
+
+    @timed('edge_paths')
+    def build_edge_path(self, geometry, transform):
+        """Create the path of a pyfeyngen edge (straight, or a quadratic curve for bent edges) from
+            its precomputed geometry. transform: from the layer it goes in to the document."""
+        p0, control, p2, bent, middle, (ux, uy) = geometry
+        path_elem = PathElement()
+        if bent:
+            commands = [('M', p0), ('Q', control, p2)]
+            skeleton = inkex.Path([inkex.paths.Move(*p0), inkex.paths.Quadratic(*control, *p2)])
+        else:
+            commands = [('M', p0), ('L', p2)]
+            skeleton = inkex.Path([inkex.paths.Move(*p0), inkex.paths.Line(*p2)])
+        path_elem.set('d', self.format_path(commands))
+        path_elem.style = {'stroke': 'black', 'stroke-width': '1', 'fill': 'none'}
+        # Seed the geometry record, so the arrow and label helpers only read the precomputed frame
+        frame = (tuple(middle), (ux, uy), (-uy, ux)) if ux or uy else None
+        self.geometry_cache[path_elem] = PathGeometry(skeleton, transform, self.edge_superpath(geometry), frame)
+        return path_elem
+
+    @timed('generate_diagram')
+    def generate_diagram(self, data, parent=None, origin=(50, 50)):
+        """ Generate the diagram from pyfeyngen data into parent (default: current layer), 
+            shifted by origin and scaled by the diagram scale. Each vertex is drawn once."""
+        layer, origin = self.diagram_layer(parent if parent is not None else self.svg.get_current_layer(), origin)
+        for _ in self.iter_diagram(data, layer, origin): pass
+
+    def diagram_layer(self, parent, origin):
+        """Return (layer, origin) to draw a diagram at origin in: a new group of parent holding the
+            diagram scale and position as its transform, or parent itself at scale 1."""
+        scale = self.options.gen_scale
+        if scale == 1: return parent, origin
+        group = Group()
+        group.set('id', self.get_unique_id("scale"))
+        self.register_element(group)
+        fmt = self.format_number
+        self.set_transform(group, f"translate({fmt(origin[0])},{fmt(origin[1])}) scale({scale:g})")
+        parent.add(group)
+        return group, (0, 0)
+
+    def iter_diagram(self, data, parent=None, origin=(50, 50)):
+        """Draw the edges of pyfeyngen data one by one (see generate_diagram), yielding each edge
+            once its path, ghost and label are in parent, then None once the vertices are drawn.
+            data['edges'] may be any iterable."""
+        layer = parent if parent is not None else self.svg.get_current_layer()
+        offset_x, offset_y = origin
 
-        # Track already marked nodes to avoid overlapping blobs
-        nodes_already_marked = set()
         # Identify nodes that should have a special style
         special_nodes = {nid for nid, info in data['nodes'].items() if info.get('style') == 'blob'}
-
-        for edge in data['edges']:
-            # 1. Compute world coordinates
-            x1 = edge['start'][0] * scale + offset_x
-            y1 = edge['start'][1] * scale + offset_y
-            x2 = edge['end'][0] * scale + offset_x
-            y2 = edge['end'][1] * scale + offset_y
-
+        # Blob nodes met on the edges, drawn once each at the end
+        marked_nodes = {}
+        base_style = self.style_from_options()
+
+        edges = data['edges']
+        transform = self.composed_transform(layer)
+        placer = self.get_label_placer()
+        if placer is not None:
+            for nid in special_nodes:
+                x, y = transform.apply_to_point((data['nodes'][nid]['x'] + offset_x, data['nodes'][nid]['y'] + offset_y))
+                placer.add_point(x, y, base_style.v_size * 2.5)
+            if isinstance(edges, list):
+                # Every propagator is known before the first label is placed
+                for batch in self.edge_batches(edges):
+                    self.add_edge_obstacles(batch, self.batch_geometry(batch, offset_x, offset_y), transform, base_style)
+
+        for batch in self.edge_batches(edges):
+            # 1. Compute world coordinates, for the whole batch at once
+            geometry = self.batch_geometry(batch, offset_x, offset_y)
+            if placer is not None and not isinstance(edges, list):
+                # Streamed edges: only the propagators of the batches drawn so far are avoided
+                self.add_edge_obstacles(batch, geometry, transform, base_style)
+            yield from self.draw_edges(batch, geometry, layer, transform, special_nodes, marked_nodes, data['nodes'], base_style)
+
+        # 5. Vertices, above the propagators
+        if marked_nodes:
+            points = [(node['x'] + offset_x, node['y'] + offset_y) for node in marked_nodes.values()]
+            self.add_vertices(points, base_style._replace(v_style="blob"), 'black', layer, transform)
+        yield None
+
+    def edge_batches(self, edges):
+        """Split the edges (any iterable) into batches of EDGE_BATCH, whose geometry is computed at once."""
+        edges = iter(edges)
+        while True:
+            batch = list(itertools.islice(edges, self.EDGE_BATCH))
+            if not batch: return
+            yield batch
+
+    def add_edge_obstacles(self, edges, geometry, transform, base_style:FeynmanStyle):
+        """Add edges to the obstacles of the label placer from their precomputed geometry."""
+        for edge, shape in zip(edges, geometry):
+            csp = [[[list(transform.apply_to_point(point)) for point in node] for node in sub]
+                   for sub in self.edge_superpath(shape)]
+            self.add_obstacle(csp, base_style._replace(p_type=edge['type']))
+
+    def draw_edges(self, edges, geometry, layer, transform, special_nodes, marked_nodes, nodes, base_style):
+        """Create the paths of edges in layer one at a time and style them, yielding each edge (see iter_diagram)."""
+        for edge, shape in zip(edges, geometry):
             # 2. Create the SVG path
-            path_elem = PathElement()
-
-            # Get the curvature sent by the library
-            # If bend == 0, it's a straight line.
-            bend = edge.get('bend', 0.0)
-
-            if bend != 0:
-                # 1. Compute the midpoint (M)
-                mx, my = (x1 + x2) / 2, (y1 + y2) / 2
-
-                # 2. Direction vector (V)
-                dx, dy = (x2 - x1), (y2 - y1)
-                dist = (dx**2 + dy**2)**0.5
-
-                if dist > 0.001:
-                    # 3. Compute the control point (Q)
-                    # The offset is perpendicular: (-dy, dx)
-                    # Multiply by 'bend' for amplitude
-                    cx = mx - (dy / dist) * (dist * bend)
-                    cy = my + (dx / dist) * (dist * bend)
-
-                    path_elem.set('d', f"M {x1},{y1} Q {cx},{cy} {x2},{y2}")
-                else:
-                    # Safety: if points are overlapping
-                    path_elem.set('d', f"M {x1},{y1} L {x2},{y2}")
-            else:
-                # Standard straight line
-                path_elem.set('d', f"M {x1},{y1} L {x2},{y2}")
-
-            path_elem.style = {'stroke': 'black', 'stroke-width': '1', 'fill': 'none'}
+            path_elem = self.build_edge_path(shape, transform)
             layer.add(path_elem)
+            self.stats.count('edges')
 
-            # 3. Save and temporarily set options
-            original_opts = {
-                'p_type': self.options.p_type,
-                'momentum_label': self.options.momentum_label,
-                'arrow_type': self.options.arrow_type,
-                'v_style': self.options.v_style,
-                'v_location': self.options.v_location,
-                'momentum_arrow': self.options.momentum_arrow
-            }
-
-            # Configure according to edge data
-            self.options.p_type = edge['type']
-            self.options.momentum_label = edge.get('label', '')
-            self.options.momentum_arrow = "none"
-
+            # 3. Resolve the style of the edge from its data
             # Handle arrow orientation (Fermions / Anti-particles)
             if edge['type'] == 'fermion':
-                self.options.arrow_type = "backward" if edge.get('is_anti', False) else "forward"
-            else:
-                self.options.arrow_type = "none"
-
-            s_node, e_node = edge['start_node'], edge['end_node']
-
-            # A marker is only placed if the node is a 'blob' AND has not already been marked
-            start_needs_blob = (s_node in special_nodes and s_node not in nodes_already_marked)
-            end_needs_blob = (e_node in special_nodes and e_node not in nodes_already_marked)
-
-            if start_needs_blob and end_needs_blob:
-                self.options.v_style, self.options.v_location = "blob", "both"
-                nodes_already_marked.update([s_node, e_node])
-            elif start_needs_blob:
-                self.options.v_style, self.options.v_location = "blob", "start"
-                nodes_already_marked.add(s_node)
-            elif end_needs_blob:
-                self.options.v_style, self.options.v_location = "blob", "end"
-                nodes_already_marked.add(e_node)
+                arrow_type = "backward" if edge.get('is_anti', False) else "forward"
             else:
-                self.options.v_style = "none"
-
-            # 4. Apply existing visual treatments
-            self.apply_particle_lpe(path_elem)
-            self.apply_vertices(path_elem)
-
-            if self.options.arrow_type != "none":
-                self.apply_separate_arrow(path_elem)
+                arrow_type = "none"
 
-            if self.options.momentum_label:
-                self.apply_momentum_flow(path_elem)
+            for nid in (edge['start_node'], edge['end_node']):
+                if nid in special_nodes: marked_nodes[nid] = nodes[nid]
 
-            # 5. Restore user interface options
-            for key, val in original_opts.items():
-                setattr(self.options, key, val)
+            style = base_style._replace(p_type=edge['type'], momentum_label=edge.get('label', ''),
+                                        momentum_arrow="none", arrow_type=arrow_type)
 
-    def get_start_end_from_elem(self, elem:inkex.PathElement):
-        """Return the start and end coordinates of a path element, transformed to document coordinates."""
-
-        path = elem.path.to_superpath()
+            # 4. Apply existing visual treatments
+            self.apply_particle_lpe(path_elem, style)
 
-        start_raw = path[0][0][1]
-        end_raw = path[0][-1][1]
+            if style.arrow_type != "none":
+                self.apply_separate_arrow(path_elem, style)
 
-        # Apply the object's transformation matrix to get the real X/Y
-        start_pt = elem.transform.apply_to_point(start_raw)
-        end_pt = elem.transform.apply_to_point(end_raw)
+            if style.momentum_label:
+                self.apply_momentum_flow(path_elem, style)
 
-        x1, y1 = start_pt.x, start_pt.y
-        x2, y2 = end_pt.x, end_pt.y
+            yield edge
 
-        return (x1, y1), (x2, y2)
+    def get_start_end_from_elem(self, elem:inkex.PathElement):
+        """Return the start and end coordinates of a path element, with its own transform applied."""
+        record = self.path_geometry(elem)
+        return record.start, record.end
 
 
 
@@ -0,0 +1,95 @@
+"""Collision avoidance for the momentum labels and arrows.
+
+Propagators, vertices and the labels and arrows already placed are kept as axis-aligned boxes in
+a uniform grid, so finding what lies near a new label costs the same whatever the size of the
+diagram. Each new label (with its arrow) goes to the nearest candidate position free of overlaps.
+"""
+import math
+
+# Size of the grid cells, about the size of a short label
+CELL_SIZE = 20.0
+
+class BoxGrid:
+    """Uniform grid of axis-aligned boxes (x0, y0, x1, y1)."""
+    __slots__ = ("cell", "cells")
+
+    def __init__(self, cell=CELL_SIZE):
+        self.cell = cell
+        self.cells = {}
+
+    def keys(self, box):
+        """Return the grid cells covered by a box."""
+        c = self.cell
+        return [(i, j) for i in range(math.floor(box[0] / c), math.floor(box[2] / c) + 1)
+                       for j in range(math.floor(box[1] / c), math.floor(box[3] / c) + 1)]
+
+    def insert(self, box):
+        for key in self.keys(box):
+            self.cells.setdefault(key, []).append(box)
+
+    def collides(self, box):
+        """Return True if the box overlaps a box of the grid."""
+        for key in self.keys(box):
+            for other in self.cells.get(key, ()):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    return True
+        return False
+
+def text_box(x, y, angle, text, font_size=10.0):
+    """Return the approximate box of a text centred on (x, y) and rotated by angle (degrees)."""
+    half_w, half_h = 0.3 * font_size * max(len(text), 1), 0.5 * font_size
+    c, s = abs(math.cos(math.radians(angle))), abs(math.sin(math.radians(angle)))
+    w, h = half_w * c + half_h * s, half_w * s + half_h * c
+    return (x - w, y - h, x + w, y + h)
+
+def segment_box(a, b, pad):
+    """Return the box of the segment ab, widened by pad."""
+    return (min(a[0], b[0]) - pad, min(a[1], b[1]) - pad, max(a[0], b[0]) + pad, max(a[1], b[1]) + pad)
+
+class LabelPlacer:
+    """Places momentum labels and arrows on the nearest free position, for one run."""
+
+    def __init__(self, step=6.0, rings=3):
+        self.grid = BoxGrid()
+        self.step = step
+        self.rings = rings
+
+    def add_polyline(self, points, pad=1.0):
+        """Add an obstacle line (a propagator), cut into pieces no longer than a grid cell."""
+        for a, b in zip(points, points[1:]):
+            length = math.hypot(b[0] - a[0], b[1] - a[1])
+            pieces = max(1, math.ceil(length / self.grid.cell))
+            for k in range(pieces):
+                t0, t1 = k / pieces, (k + 1) / pieces
+                self.grid.insert(segment_box((a[0] + (b[0] - a[0]) * t0, a[1] + (b[1] - a[1]) * t0),
+                                             (a[0] + (b[0] - a[0]) * t1, a[1] + (b[1] - a[1]) * t1), pad))
+
+    def add_point(self, x, y, radius):
+        """Add a round obstacle (a vertex)."""
+        self.grid.insert((x - radius, y - radius, x + radius, y + radius))
+
+    def add_box(self, box):
+        """Add a box obstacle (a label or arrow already in the document)."""
+        self.grid.insert(box)
+
+    def candidates(self, offset):
+        """Return the (normal offset, tangent shift) to try, nearest to (offset, 0) first:
+            further from the path, on the other side, and slid along it."""
+        step, rings = self.step, self.rings
+        shifts = [0.0] + [sign * k * step for k in range(1, rings + 1) for sign in (1, -1)]
+        tries = [(side * (offset + k * step), shift) for k in range(rings + 1) for side in (1, -1) for shift in shifts]
+        return sorted(tries, key=lambda c: abs(c[0] - offset) + abs(c[1]))
+
+    def place(self, boxes_at, offset):
+        """Return the first free (normal offset, tangent shift), boxes_at(offset, shift) giving the
+            boxes of the label and arrow there, and reserve its boxes. Keeps (offset, 0) if none is free."""
+        for candidate in self.candidates(offset):
+            boxes = boxes_at(*candidate)
+            if not any(self.grid.collides(box) for box in boxes):
+                break
+        else:
+            candidate = (offset, 0.0)
+            boxes = boxes_at(*candidate)
+        for box in boxes:
+            self.grid.insert(box)
+        return candidate
@@ -0,0 +1,113 @@
+"""Opt-in instrumentation of the extension runs.
+
+Enabled with the "Profiling" advanced option or the PYINKFEYN_PROFILE environment variable
+("summary" or "cprofile"). Records the wall time and number of calls of each phase of a run,
+and the number of elements and definitions created, then writes them next to the document:
+<document>.pyinkfeyn-profile.json, plus <document>.pyinkfeyn.prof (pstats) in cprofile mode.
+Phase times are inclusive: a phase running inside another one is counted in both.
+"""
+import os
+import json
+import time
+import cProfile
+import tempfile
+import functools
+from collections import Counter, defaultdict
+
+MODES = ("none", "summary", "cprofile")
+
+class Phase:
+    """Context manager adding its duration to a phase of RunStats."""
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats, self.name = stats, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.stats.times[self.name] += time.perf_counter() - self.start
+        self.stats.calls[self.name] += 1
+
+class NoPhase:
+    """Context manager doing nothing, used when profiling is disabled."""
+    __slots__ = ()
+
+    def __enter__(self): pass
+
+    def __exit__(self, *exc): pass
+
+NO_PHASE = NoPhase()
+
+class RunStats:
+    """Wall time and call count per phase, and counts of created elements, for one run."""
+
+    def __init__(self):
+        self.mode = "none"
+        self.times = defaultdict(float)
+        self.calls = Counter()
+        self.created = Counter()
+        self.profiler = None
+        self.start = None
+
+    @property
+    def enabled(self):
+        return self.mode != "none"
+
+    def enable(self, mode : str):
+        """Start recording, in "summary" or "cprofile" mode. Does nothing if already started."""
+        if self.enabled or mode not in MODES or mode == "none": return
+        self.mode = mode
+        self.start = time.perf_counter()
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def phase(self, name : str):
+        """Return a context manager timing a phase (a no-op when disabled)."""
+        return Phase(self, name) if self.enabled else NO_PHASE
+
+    def count(self, kind : str, n=1):
+        """Count created elements of a kind."""
+        if self.enabled: self.created[kind] += n
+
+    def report(self):
+        """Return the recorded data as a dict."""
+        return {
+            'total_seconds': round(time.perf_counter() - self.start, 6),
+            'phases': {name: {'seconds': round(self.times[name], 6), 'calls': self.calls[name]}
+                       for name in sorted(self.times, key=self.times.get, reverse=True)},
+            'created': dict(self.created),
+        }
+
+    def write(self, document_path=None, **extra):
+        """Stop recording and write the report (and pstats dump) next to document_path,
+            or in the temporary folder for unsaved documents. Returns the report file name."""
+        if not self.enabled: return None
+        if self.profiler is not None:
+            self.profiler.disable()
+        if document_path:
+            base = os.path.splitext(document_path)[0]
+        else:
+            base = os.path.join(tempfile.gettempdir(), "pyinkfeyn")
+        report = self.report()
+        report.update(extra)
+        with open(base + ".pyinkfeyn-profile.json", 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        if self.profiler is not None:
+            self.profiler.dump_stats(base + ".pyinkfeyn.prof")
+        self.mode = "none"
+        return base + ".pyinkfeyn-profile.json"
+
+def timed(name : str):
+    """Decorator timing a FeynmanLogic method as the given phase when profiling is enabled."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.stats.enabled:
+                return method(self, *args, **kwargs)
+            with self.stats.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
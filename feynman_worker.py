@@ -0,0 +1,271 @@
+"""Optional warm worker running the extension in a long-lived process.
+
+Every Inkscape run of an extension starts a new Python, imports inkex, lxml and pyfeyngen and
+only then draws. The worker does this once and keeps the per-process caches (pattern tiles,
+arc-length tables) warm; feynman_client.py, the script called by Inkscape, forwards the
+document and options to it over a Unix socket and falls back to running in-process if no
+worker answers. Start it in the background, e.g. at login:
+
+    python feynman_worker.py [--socket PATH] [--idle SECONDS]
+    python feynman_worker.py --stop
+
+Restart the worker after updating the extension, as it keeps running the code it started with.
+
+The socket is only used if it and the worker behind it belong to the user, in a folder closed to
+other users; a worker which does not answer within TIMEOUT seconds is given up for an in-process run.
+
+Protocol: every message is a sequence of frames (4-byte big-endian length, then the payload).
+A request is a JSON header {"args", "cwd", "env"} followed by the input document; the answer
+is a JSON header {"status", "stderr"} followed by the output document (empty if unchanged).
+"""
+import io
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import tempfile
+import argparse
+import contextlib
+import traceback
+
+# Environment variables of the client applied to the worker during a request
+FORWARDED_ENV = ('DOCUMENT_PATH', 'PYINKFEYN_PROFILE', 'PYINKFEYN_CACHE_DIR', 'XDG_CACHE_HOME')
+# Seconds to wait for the answer of the worker before running in-process
+TIMEOUT = 120
+
+def socket_path():
+    """Return the worker socket location: $PYINKFEYN_SOCKET, or a file in a private per-user folder."""
+    path = os.environ.get('PYINKFEYN_SOCKET')
+    if path: return path
+    folder = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), f"pyinkfeyn-{os.getuid()}")
+    return os.path.join(folder, 'pyinkfeyn.sock')
+
+def private_folder(path, create=False):
+    """Return True if the folder of the socket belongs to the user (or to root) and other users
+        cannot replace files in it (closed, or sticky as /tmp). Creates it with mode 0700 if asked."""
+    folder = os.path.dirname(os.path.abspath(path))
+    if create:
+        with contextlib.suppress(FileExistsError):
+            os.mkdir(folder, 0o700)
+    try:
+        info = os.lstat(folder)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid not in (os.getuid(), 0): return False
+    return not info.st_mode & 0o022 or bool(info.st_mode & stat.S_ISVTX)
+
+def owned_socket(path):
+    """Return True if path is a socket created by the user."""
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+def peer_is_user(sock):
+    """Return True if the process at the other end of a connected socket runs as the user
+        (checked where the system tells, that is on Linux)."""
+    if not hasattr(socket, 'SO_PEERCRED'): return True
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1] == os.getuid()
+
+def send_frame(sock, payload : bytes):
+    sock.sendall(struct.pack('!I', len(payload)) + payload)
+
+def recv_exact(sock, size : int):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk: raise ConnectionError("connection closed by the peer")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def recv_frame(sock):
+    return recv_exact(sock, struct.unpack('!I', recv_exact(sock, 4))[0])
+
+def connect(path=None, timeout=TIMEOUT):
+    """Return a socket connected to the worker, or None if no worker of the user is running."""
+    if not hasattr(socket, 'AF_UNIX'): return None
+    path = path or socket_path()
+    if not private_folder(path) or not owned_socket(path): return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        if peer_is_user(sock): return sock
+    except OSError:
+        pass
+    sock.close()
+    return None
+
+def forward(args, path=None):
+    """Run the extension with Inkscape's arguments in the worker.
+        Returns (status, stderr text, output document), or None if no worker could do it in time."""
+    input_file = args[-1] if args and not args[-1].startswith('-') else None
+    if input_file is None or not os.path.isfile(input_file): return None
+    sock = connect(path, TIMEOUT)
+    if sock is None: return None
+    try:
+        with sock, open(input_file, 'rb') as f:
+            header = {'args': args, 'cwd': os.getcwd(),
+                      'env': {key: os.environ[key] for key in FORWARDED_ENV if key in os.environ}}
+            send_frame(sock, json.dumps(header).encode('utf-8'))
+            send_frame(sock, f.read())
+            answer = json.loads(recv_frame(sock))
+            return answer['status'], answer['stderr'], recv_frame(sock)
+    except (OSError, ValueError, KeyError):
+        return None
+
+@contextlib.contextmanager
+def request_context(cwd, env):
+    """Run a request in the client's folder, with its environment variables."""
+    saved_cwd = os.getcwd()
+    saved_env = {key: os.environ.get(key) for key in FORWARDED_ENV}
+    for key in FORWARDED_ENV:
+        os.environ.pop(key, None)
+    os.environ.update(env)
+    try:
+        if cwd: os.chdir(cwd)
+        yield
+    finally:
+        os.chdir(saved_cwd)
+        for key, value in saved_env.items():
+            if value is None: os.environ.pop(key, None)
+            else: os.environ[key] = value
+
+def run_extension(args, document : bytes):
+    """Run the extension on a document, as Inkscape would run feynman_logic.py.
+        Returns (status, stderr text, output document)."""
+    from feynman_logic import FeynmanLogic
+    import inkex
+    stderr, output = io.StringIO(), io.BytesIO()
+    status = 0
+    with contextlib.redirect_stderr(stderr):
+        ext = FeynmanLogic()
+        try:
+            ext.parse_arguments(args)
+            ext.options.input_file = io.BytesIO(document)
+            ext.options.output = output
+            ext.load_raw()
+            ext.save_raw(ext.effect())
+        except inkex.utils.AbortExtension as err:
+            inkex.errormsg(str(err))
+            status = 1
+        except SystemExit as err:
+            status = err.code if isinstance(err.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            ext.clean_up()
+    return status, stderr.getvalue(), output.getvalue()
+
+def warm_up():
+    """Import the extension and its dependencies, and fill the per-process caches
+        by drawing every particle type once."""
+    from feynman_logic import FeynmanLogic
+    ext = FeynmanLogic()
+    ext.parse_arguments(['--gen_cache=false'])
+    ext.document = ext.get_template(width=100, height=100)
+    ext.svg = ext.document.getroot()
+    edges = [{'start_node': 'a', 'end_node': 'b', 'start': (0, 0), 'end': (100, 0), 'type': p_type,
+              'label': 'p', 'is_anti': False, 'bend': 0.2} for p_type in ext.patterns]
+    ext.generate_diagram({'nodes': {'a': {'x': 0, 'y': 0, 'style': 'blob'}, 'b': {'x': 100, 'y': 0, 'style': 'default'}},
+                          'edges': edges})
+    for p_type in ext.patterns:
+        ext.get_pattern_tile(p_type, 5.0)
+    ext.svg.tostring()
+
+def handle(conn):
+    """Answer one request. Returns False if the worker was asked to stop."""
+    header = json.loads(recv_frame(conn))
+    if header.get('command') == 'stop':
+        # Stop even if the client is gone before the answer
+        with contextlib.suppress(OSError):
+            send_frame(conn, json.dumps({'status': 0, 'stderr': ''}).encode('utf-8'))
+            send_frame(conn, b'')
+        return False
+    document = recv_frame(conn)
+    with request_context(header.get('cwd'), header.get('env', {})):
+        status, stderr, output = run_extension(header['args'], document)
+    send_frame(conn, json.dumps({'status': status, 'stderr': stderr}).encode('utf-8'))
+    send_frame(conn, output)
+    return True
+
+def serve(path=None, idle=0):
+    """Answer requests on the Unix socket until stopped, or idle for `idle` seconds (0: never)."""
+    path = path or socket_path()
+    if not private_folder(path, create=True):
+        raise RuntimeError(f"the folder of {path} must belong to you and be closed to other users")
+    sock = connect(path, timeout=1)
+    if sock is not None:
+        sock.close()
+        raise RuntimeError(f"a worker is already running on {path}")
+    try:
+        os.unlink(path)  # Left by a worker that did not stop cleanly
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        raise RuntimeError(f"cannot replace {path}: {e}")
+    warm_up()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)  # Only the user may connect
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(8)
+    server.settimeout(idle or None)
+    try:
+        running = True
+        while running:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            with conn:
+                conn.settimeout(60)
+                try:
+                    running = handle(conn)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Request failed : {str(e)}", file=sys.stderr)
+    finally:
+        server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+
+def stop(path=None):
+    """Ask the running worker to stop. Returns False if none is running."""
+    sock = connect(path, timeout=10)
+    if sock is None: return False
+    with sock:
+        send_frame(sock, json.dumps({'command': 'stop'}).encode('utf-8'))
+        recv_frame(sock)
+        recv_frame(sock)
+    return True
+
+def main(argv=None):
+    """Command line entry point. Returns the exit status."""
+    parser = argparse.ArgumentParser(description="Warm worker process for the PyinkFeyn extensions.")
+    parser.add_argument("--socket", help="Socket file (default: $PYINKFEYN_SOCKET or a per-user file)")
+    parser.add_argument("--idle", type=float, default=0, help="Stop after this many idle seconds (0: never)")
+    parser.add_argument("--stop", action="store_true", help="Stop the running worker")
+    args = parser.parse_args(argv)
+    if not hasattr(socket, 'AF_UNIX'):
+        parser.error("Unix sockets are not available on this system")
+    if args.stop:
+        return 0 if stop(args.socket) else 1
+    try:
+        serve(args.socket, args.idle)
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def pyfeyngen():
+    """The pyfeyngen package. Skips the test if it is not installed: the pyfeyngen folder of the
+        repository only holds its readme."""
+    module = pytest.importorskip("pyfeyngen")
+    if not hasattr(module, 'quick_geometry'): pytest.skip("pyfeyngen is not installed")
+    return module
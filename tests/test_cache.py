@@ -0,0 +1,58 @@
+"""On-disk layout cache (feynman_cache.py) and its use by the extension."""
+import itertools
+
+import pytest
+
+import feynman_cache
+from feynman_cache import LayoutCache
+
+def layout(n):
+    return {'nodes': {f"v{i}": {'x': i * 10.0, 'y': 0.0, 'style': 'default'} for i in range(n)}, 'edges': []}
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Make the cache timestamps strictly increasing."""
+    ticks = itertools.count()
+    monkeypatch.setattr(feynman_cache.time, 'time', lambda: float(next(ticks)))
+
+def test_layout_is_found_again_whatever_the_whitespace(tmp_path):
+    cache = LayoutCache(str(tmp_path / "layouts.sqlite"))
+    cache.put(cache.key("e+ e- > gamma > mu+ mu-", 150, 100, "1"), layout(4))
+    assert cache.get(cache.key("  e+  e- >\tgamma > mu+ mu- ", 150, 100, "1")) == layout(4)
+    # Another spacing or pyfeyngen version is another layout
+    assert cache.get(cache.key("e+ e- > gamma > mu+ mu-", 200, 100, "1")) is None
+    assert cache.get(cache.key("e+ e- > gamma > mu+ mu-", 150, 100, "2")) is None
+    # Kept in the file
+    assert LayoutCache(cache.path).get(cache.key("e+ e- > gamma > mu+ mu-", 150, 100, "1")) == layout(4)
+
+def test_least_recently_used_layouts_are_evicted(tmp_path, clock):
+    cache = LayoutCache(str(tmp_path / "layouts.sqlite"))
+    cache.put("a", layout(50))
+    size = cache.connect().execute("SELECT size FROM layouts").fetchone()[0]
+    cache.max_bytes = 3 * size
+    cache.put("b", layout(50))
+    cache.put("c", layout(50))
+    assert cache.get("a") is not None
+    cache.put("d", layout(50))
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+
+def test_clear_removes_every_layout(tmp_path):
+    cache = LayoutCache(str(tmp_path / "layouts.sqlite"))
+    cache.put("a", layout(3))
+    cache.put("b", layout(3))
+    cache.clear()
+    assert cache.get("a") is None and cache.get("b") is None
+
+def test_unusable_cache_folder_only_disables_the_cache(tmp_path, monkeypatch, capsys, pyfeyngen):
+    pytest.importorskip("inkex")
+    from feynman_headless import make_extension
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    monkeypatch.setenv('PYINKFEYN_CACHE_DIR', str(blocker / "cache"))
+    ext = make_extension()
+    syntax = "e+ e- > gamma > mu+ mu-"
+    data = ext.compute_geometry(syntax)
+    assert data == pyfeyngen.quick_geometry(syntax, ext.options.gen_x_spacing, ext.options.gen_y_spacing)
+    assert ext.get_layout_cache() is None
+    assert "Layout cache disabled" in capsys.readouterr().err
@@ -0,0 +1,129 @@
+"""Invariants of the arc-length geometry (feynman_geometry.py)."""
+import re
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from feynman_geometry import path_frame, arc_length_table, pattern_tile, bake_pattern, bezier_point, compact_path, edge_geometry
+
+def polyline(*points):
+    """CubicSuperPath of straight segments through points, with handles at a third of each
+        segment so that each is run through at constant speed."""
+    points = [np.array(p, dtype=float) for p in points]
+    nodes = [[p, p, p] for p in points]
+    for node, next_node, a, b in zip(nodes, nodes[1:], points, points[1:]):
+        node[2], next_node[0] = a + (b - a) / 3, b - (b - a) / 3
+    return [[[list(map(float, q)) for q in node] for node in nodes]]
+
+def test_middle_of_a_multi_segment_path_is_at_half_its_length():
+    # Lengths 10 and 30: the middle is 10 along the second segment, not at a node
+    point, tangent, normal = path_frame(polyline((0, 0), (10, 0), (10, 30)))
+    assert point == pytest.approx((10, 10), abs=1e-6)
+    assert tangent == pytest.approx((0, 1), abs=1e-6)
+    assert normal == pytest.approx((-1, 0), abs=1e-6)
+
+def test_frame_at_a_fraction_of_a_curved_path():
+    # Quarter circle of radius 100 (cubic approximation): a quarter of its length is at 22.5 degrees
+    k = 0.5522847498 * 100
+    csp = [[[[100, 0], [100, 0], [100, k]], [[k, 100], [0, 100], [0, 100]]]]
+    point, tangent, _ = path_frame(csp, 0.25)
+    angle = math.radians(22.5)
+    assert point == pytest.approx((100 * math.cos(angle), 100 * math.sin(angle)), abs=0.05)
+    assert tangent == pytest.approx((-math.sin(angle), math.cos(angle)), abs=1e-3)
+    assert arc_length_table(csp).length == pytest.approx(math.pi * 50, rel=1e-4)
+
+def test_path_without_length_has_no_frame():
+    assert path_frame(polyline((5, 5), (5, 5))) is None
+
+def test_pattern_tile_is_normalized():
+    # One wave of the photon pattern, "m 0,0 c 5,-10 10,10 15,0"
+    segments, width, height = pattern_tile([[[[0, 0], [0, 0], [5, -10]], [[10, 10], [15, 0], [15, 0]]]])
+    samples = np.array([bezier_point(s, t) for s in segments for t in np.linspace(0, 1, 33)])
+    assert width == pytest.approx(15)
+    assert samples[:, 0].min() == pytest.approx(0) and samples[:, 0].max() == pytest.approx(1)
+    assert samples[:, 1].min() == pytest.approx(-0.5, abs=1e-9) and samples[:, 1].max() == pytest.approx(0.5, abs=1e-9)
+
+def test_baked_pattern_follows_a_straight_path():
+    # A tile made of one straight segment 1 unit off the path, along a 95 units long path
+    tile = np.array([[[0, 1], [1 / 3, 1], [2 / 3, 1], [1, 1]]], dtype=float)
+    baked = bake_pattern(polyline((0, 0), (95, 0)), tile, 10.0, offset=0.5)
+    # A whole number of copies, stretched to the length of the path
+    assert baked.shape == (10, 4, 2)
+    # Across the path along its normal, (0, 1) here
+    assert baked[:, :, 1] == pytest.approx(np.full((10, 4), 1.5))
+    assert baked[:, 0, 0] == pytest.approx(np.arange(10) * 9.5)
+    assert baked[-1, 3, 0] == pytest.approx(95)
+
+def test_nothing_is_baked_along_a_path_without_length():
+    tile = np.zeros((1, 4, 2))
+    assert bake_pattern(polyline((5, 5), (5, 5)), tile, 10.0) is None
+
+def absolute_points(d):
+    """Absolute points of path data written by compact_path (relative m, l, q, c commands)."""
+    tokens = re.findall(r"[mlqc]|-?\d+(?:\.\d+)?", d)
+    points, letter, current = [], None, (0.0, 0.0)
+    numbers = []
+    for token in tokens + ['m']:
+        if token in 'mlqc':
+            if letter is not None:
+                size = {'m': 2, 'l': 2, 'q': 4, 'c': 6}[letter]
+                assert len(numbers) % size == 0
+                for k in range(0, len(numbers), size):
+                    group = [(current[0] + numbers[i], current[1] + numbers[i + 1]) for i in range(k, k + size, 2)]
+                    points.extend(group)
+                    current = group[-1]
+            letter, numbers = token, []
+        else:
+            numbers.append(float(token))
+    return points
+
+@pytest.mark.parametrize("precision", [1, 3, 5])
+def test_compact_path_round_trips_within_the_precision(precision):
+    rng = np.random.default_rng(precision)
+    commands, points = [('M', tuple(rng.uniform(-500, 500, 2)))], []
+    for _ in range(200):
+        letter = rng.choice(['L', 'Q', 'C'])
+        count = {'L': 1, 'Q': 2, 'C': 3}[letter]
+        commands.append((letter, *[tuple(rng.uniform(-500, 500, 2)) for _ in range(count)]))
+    for _, *command_points in commands:
+        points.extend(command_points)
+    decoded = absolute_points(compact_path(commands, precision))
+    assert len(decoded) == len(points)
+    # Points are rounded once, so errors do not add up along the path
+    assert np.abs(np.array(decoded) - np.array(points)).max() <= 0.5 * 10 ** -precision + 1e-9
+
+def scalar_edge(start, end, bend):
+    """Control point of an edge as computed edge by edge before edge_geometry (None if straight)."""
+    (x1, y1), (x2, y2) = start, end
+    dx, dy = x2 - x1, y2 - y1
+    dist = math.hypot(dx, dy)
+    if bend == 0 or dist <= 0.001: return None
+    return ((x1 + x2) / 2 - (dy / dist) * (dist * bend), (y1 + y2) / 2 + (dx / dist) * (dist * bend))
+
+def test_edge_geometry_matches_the_edges_computed_one_by_one():
+    rng = np.random.default_rng(0)
+    starts, ends = rng.uniform(-300, 300, (50, 2)), rng.uniform(-300, 300, (50, 2))
+    bends = np.where(np.arange(50) % 2, rng.uniform(-0.5, 0.5, 50), 0.0)
+    p0, control, p2, bent, middle, tangent = edge_geometry(starts, ends, bends, (50, 50), precision=6)
+    for k in range(50):
+        expected = scalar_edge(starts[k] + 50, ends[k] + 50, bends[k])
+        assert bent[k] == (expected is not None)
+        assert p0[k] == pytest.approx(starts[k] + 50, abs=1e-6) and p2[k] == pytest.approx(ends[k] + 50, abs=1e-6)
+        if expected is None:
+            expected = (p0[k] + p2[k]) / 2
+            csp = polyline(p0[k], p2[k])
+        else:
+            csp = [[[list(p0[k]), list(p0[k]), list(p0[k] + 2 * (expected - p0[k]) / 3)],
+                    [list(p2[k] + 2 * (expected - p2[k]) / 3), list(p2[k]), list(p2[k])]]]
+        assert control[k] == pytest.approx(expected, abs=1e-5)
+        # The middle and tangent are those of the arc-length frame of the curve
+        point, unit, _ = path_frame(csp)
+        assert middle[k] == pytest.approx(point, abs=1e-3)
+        assert tangent[k] == pytest.approx(unit, abs=1e-3)
+
+def test_edges_without_length_have_no_tangent():
+    _, _, _, bent, _, tangent = edge_geometry([(1, 1)], [(1, 1)], [0.3])
+    assert not bent[0]
+    assert tangent[0] == pytest.approx((0, 0))
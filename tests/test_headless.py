@@ -0,0 +1,105 @@
+"""Headless generation (feynman_headless.py): output, document size and memory of streamed generation."""
+import os
+import re
+from collections import Counter
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("inkex")
+pytest.importorskip("numpy")
+
+import inkex
+from feynman_headless import make_extension, stream_extension, render, render_parallel, main
+
+TYPES = ['fermion', 'photon', 'gluon', 'scalar', 'boson', 'ghost']
+
+def chain(n_edges):
+    """Geometry of a zigzag chain of n_edges labelled, partly bent edges."""
+    nodes = {f"v{i}": {'x': i * 10, 'y': (i % 7) * 20, 'style': 'blob' if i % 5 == 0 else 'default'}
+             for i in range(n_edges + 1)}
+    edges = [{'start_node': f"v{i}", 'end_node': f"v{i + 1}",
+              'start': (nodes[f"v{i}"]['x'], nodes[f"v{i}"]['y']), 'end': (nodes[f"v{i + 1}"]['x'], nodes[f"v{i + 1}"]['y']),
+              'type': TYPES[i % len(TYPES)], 'label': 'p' if i % 2 else '', 'is_anti': i % 3 == 0,
+              'bend': 0.2 if i % 4 == 0 else 0.0} for i in range(n_edges)]
+    return {'nodes': nodes, 'edges': edges}
+
+GOOD = "e+ e- > gamma > mu+ mu-"
+BAD = "e+ e- > ("
+
+def test_reaction_is_written_to_the_output(tmp_path, pyfeyngen):
+    output = tmp_path / "diagram.svg"
+    assert main([GOOD, "-o", str(output)]) == 0
+    assert len(inkex.load_svg(output.read_bytes()).getroot().findall('.//{http://www.w3.org/2000/svg}path')) >= 3
+
+def test_failed_reaction_writes_nothing_and_fails(tmp_path, pyfeyngen):
+    output = tmp_path / "diagram.svg"
+    assert main([BAD, "-o", str(output)]) == 1
+    assert not output.exists()
+    assert render(BAD) is None
+
+def test_failed_reaction_is_written_as_an_error_label_in_quiet_mode(tmp_path, pyfeyngen):
+    output = tmp_path / "diagram.svg"
+    assert main([BAD, "--quiet_error=true", "-o", str(output)]) == 1
+    assert b"Error : " in output.read_bytes()
+
+def test_pool_merges_the_diagrams_in_order_with_shared_defs(pyfeyngen):
+    syntaxes = [GOOD, BAD, "u u~ > g > t t~", GOOD]
+    svg, errors = render_parallel(syntaxes, jobs=2)
+    assert errors == [(BAD, "Unbalanced parentheses.")]
+    root = inkex.load_svg(svg).getroot()
+    groups = [node for node in root.iter(inkex.addNS('g', 'svg')) if node.get('id', '').startswith('diagram')]
+    assert [group.label for group in groups] == [GOOD, syntaxes[2], GOOD]
+    ids = Counter(node.get('id') for node in root.iter(inkex.etree.Element) if node.get('id'))
+    assert max(ids.values()) == 1
+    # One skeletal effect per particle type, shared by the diagrams
+    effects = [node.get('pattern') for node in root.defs if node.tag.endswith('path-effect')]
+    assert len(effects) == len(set(effects)) and effects
+    for node in root.iter(inkex.etree.Element):
+        for attr in ('data-feynman-ghost', 'data-feynman-label', '{http://www.inkscape.org/namespaces/inkscape}path-effect'):
+            if node.get(attr): assert node.get(attr).lstrip('#') in ids
+
+def test_pool_writes_one_file_per_reaction(tmp_path, pyfeyngen):
+    names, errors = render_parallel([GOOD, BAD], output_pattern=str(tmp_path / "d{index}.svg"), jobs=2)
+    assert names == [str(tmp_path / "d0.svg"), None]
+    assert errors == [(BAD, "Unbalanced parentheses.")]
+    assert sorted(os.listdir(tmp_path)) == ["d0.svg"]
+
+def view_box(svg):
+    return tuple(float(v) for v in re.search(rb'viewBox="([^"]*)"', svg).group(1).split())
+
+def test_document_is_fitted_to_the_vertices_where_they_are_drawn():
+    nodes = {'a': {'x': 0, 'y': 0, 'style': 'default'}, 'b': {'x': 100, 'y': 0, 'style': 'blob'},
+             'c': {'x': 200, 'y': 50, 'style': 'default'}}
+    edges = [{'start_node': start, 'end_node': end, 'start': (nodes[start]['x'], nodes[start]['y']),
+              'end': (nodes[end]['x'], nodes[end]['y']), 'type': 'fermion', 'label': '', 'is_anti': False, 'bend': 0}
+             for start, end in (('a', 'b'), ('b', 'c'))]
+    svg = render(data={'nodes': nodes, 'edges': edges}, v_size=3)
+    assert svg.count(b'<use') == 1
+    # Drawn from (50, 50) to (250, 100): the blob (radius 7.5) at (150, 50) sticks out above the
+    # edges, 20 units of margin around
+    assert view_box(svg) == pytest.approx((30, 42.5 - 20, 200 + 40, 100 - 42.5 + 40), abs=1e-6)
+
+def stream(n_edges, output, trace=False):
+    """Stream a chain to output. Returns the peak Python memory (bytes) if traced, its input excluded."""
+    data, ext = chain(n_edges), make_extension()
+    # Small batches, so that both sizes hold several of them
+    ext.EDGE_BATCH = 64
+    if not trace:
+        stream_extension(ext, data, output)
+        return None
+    tracemalloc.start()
+    try:
+        stream_extension(ext, data, output)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_streaming_memory_does_not_grow_with_the_edges():
+    with open(os.devnull, 'wb') as output:
+        # Fill the per-process caches (symbols, markers, pattern tiles) first, untraced
+        stream(200, output)
+        small, large = stream(400, output, trace=True), stream(1600, output, trace=True)
+    # Keeping the edges or their elements costs kilobytes per edge. The interpreter's free lists
+    # (capped) and the vertices met (one per node) account for the little growth allowed.
+    assert (large - small) / 1200 < 512
@@ -0,0 +1,40 @@
+"""The translation template and catalogues cover the dialogs of the .inx files."""
+import os
+import re
+
+import pytest
+
+etree = pytest.importorskip("lxml.etree")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NS = "{http://www.inkscape.org/namespace/inkscape/extension}"
+
+def dialog_strings():
+    """Translatable texts of the .inx files (see locale/inx.its)."""
+    texts = set()
+    for name in ('feynman_generate.inx', 'feynman_draw.inx'):
+        root = etree.parse(os.path.join(ROOT, name)).getroot()
+        texts.add(root.find(f"{NS}name").text)
+        for node in root.iter(f"{NS}page", f"{NS}param", f"{NS}label", f"{NS}option", f"{NS}submenu"):
+            if node.get('translatable') == 'no': continue
+            texts.update((node.get('gui-text'), node.get('gui-description')))
+            if node.tag == f"{NS}submenu": texts.add(node.get('name'))
+            if node.tag in (f"{NS}label", f"{NS}option"): texts.add(node.text)
+    return texts - {None}
+
+def catalog(path):
+    """msgid -> msgstr of a .po or .pot file, obsolete entries left out."""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    entries = {}
+    for msgid, msgstr in re.findall(r'^msgid ((?:".*"\n)+)msgstr ((?:".*"\n)+)', text, re.M):
+        unquote = lambda lines: ''.join(line[1:-1] for line in lines.split('\n') if line).replace('\\"', '"')
+        entries[unquote(msgid)] = unquote(msgstr)
+    return entries
+
+def test_template_has_every_dialog_text():
+    assert dialog_strings() <= set(catalog(os.path.join(ROOT, 'locale', 'pyinkfeyn.pot')))
+
+def test_french_catalogue_translates_every_dialog_text():
+    french = catalog(os.path.join(ROOT, 'locale', 'fr', 'LC_MESSAGES', 'fr.po'))
+    assert all(french.get(text) for text in dialog_strings())
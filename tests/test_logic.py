@@ -0,0 +1,128 @@
+"""Behaviour of the extension (feynman_logic.py) on documents: batch input, shared path effects
+and incremental restyling."""
+import io
+import json
+
+import pytest
+
+pytest.importorskip("inkex")
+
+import inkex
+from feynman_logic import FeynmanLogic
+from feynman_headless import make_extension
+
+NS_INK = "http://www.inkscape.org/namespaces/inkscape"
+
+def document(paths, defs=""):
+    """SVG document holding the given path elements (and definitions)."""
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="{NS_INK}" width="300" height="200">'
+            f'<defs>{defs}</defs><g id="layer1" inkscape:groupmode="layer">{paths}</g></svg>')
+
+def straight(eid, y, d=None):
+    return f'<path id="{eid}" d="{d or f"M 10,{y} L 190,{y}"}" style="stroke:black;fill:none"/>'
+
+def run(tmp_path, svg, *args, ids=()):
+    """Run the extension as Inkscape does on a document, with the paths ids selected.
+        Returns the resulting document."""
+    source = tmp_path / "input.svg"
+    source.write_text(svg if isinstance(svg, str) else svg.tostring().decode('utf-8'), encoding='utf-8')
+    output = io.BytesIO()
+    FeynmanLogic().run([f"--id={eid}" for eid in ids] + list(args) + [str(source)], output=output)
+    return inkex.load_svg(output.getvalue() or source.read_bytes()).getroot()
+
+def effects(root):
+    return {node.get('id'): node for node in root.defs.iter(f"{{{NS_INK}}}path-effect")}
+
+def test_batch_file_reactions_are_read_after_the_syntax_field(tmp_path):
+    batch = tmp_path / "reactions.txt"
+    batch.write_text("# comment\ne+ e- > mu+ mu-\n\n  u u~ > g > t t~  \n", encoding='utf-8')
+    ext = make_extension(["--gen_syntax=a > b\\nc > d", f"--gen_batch_file={batch}"])
+    assert ext.get_syntaxes() == ["a > b", "c > d", "e+ e- > mu+ mu-", "u u~ > g > t t~"]
+
+def test_json_batch_file_holds_strings_or_syntax_objects(tmp_path):
+    batch = tmp_path / "reactions.json"
+    batch.write_text(json.dumps(["e+ e- > mu+ mu-", {"syntax": "u u~ > g > t t~", "title": "top"}]), encoding='utf-8')
+    assert make_extension([f"--gen_batch_file={batch}"]).get_syntaxes() == ["e+ e- > mu+ mu-", "u u~ > g > t t~"]
+
+@pytest.mark.parametrize("content", ['{"syntax": "a > b"}', '3', '[{"title": "no syntax"}]', '[["a > b"]]', '[1, 2]', '[{"syntax": 3}]'])
+def test_malformed_json_batch_file_is_reported(tmp_path, capsys, content):
+    batch = tmp_path / "reactions.json"
+    batch.write_text(content, encoding='utf-8')
+    ext = make_extension([f"--gen_batch_file={batch}"])
+    with pytest.raises(ValueError):
+        ext.get_syntaxes()
+    ext.effect()
+    assert ext.generation_errors
+    assert "Error/Warning when generating" in capsys.readouterr().err
+
+def test_missing_batch_file_is_reported(tmp_path, capsys):
+    ext = make_extension([f"--gen_batch_file={tmp_path / 'missing.txt'}"])
+    ext.effect()
+    assert isinstance(ext.generation_errors[0][1], OSError)
+    assert "missing.txt" in capsys.readouterr().err
+
+def test_identical_propagators_share_one_path_effect(tmp_path):
+    svg = document(''.join(straight(f"p{i}", 20 * i + 20) for i in range(4)))
+    root = run(tmp_path, svg, "--p_type=photon", ids=("p0", "p1", "p2"))
+    root = run(tmp_path, root, "--p_type=photon", "--amplitude=8", ids=("p3",))
+    lpes = effects(root)
+    assert len(lpes) == 2
+    refs = [root.getElementById(f"p{i}").get(f"{{{NS_INK}}}path-effect") for i in range(4)]
+    assert refs[0] == refs[1] == refs[2] != refs[3]
+    assert {ref[1:] for ref in refs} == set(lpes)
+
+def test_compact_defs_merges_duplicates_and_removes_unused_effects(tmp_path):
+    lpe = '<inkscape:path-effect id="{}" effect="skeletal" pattern="#fref_photon" copytype="repeated_stretched" width="5.0" normal_offset="0"/>'
+    defs = (''.join(lpe.format(eid) for eid in ("lpe1", "lpe2", "lpe3"))
+            + '<path id="fref_photon" d="m 0,0 c 5,-10 10,10 15,0"/>'
+            + '<inkscape:path-effect id="other" effect="bend_path"/>')
+    paths = ''.join(straight(f"p{i}", 20 * i + 20).replace('/>', f' inkscape:path-effect="#lpe{i + 1}"/>') for i in range(2))
+    root = run(tmp_path, document(paths, defs), "--compact_defs=true")
+    # The duplicate and the unused effect are gone, effects which are not ours are kept
+    assert set(effects(root)) == {"lpe1", "other"}
+    assert all(root.getElementById(f"p{i}").get(f"{{{NS_INK}}}path-effect") == "#lpe1" for i in range(2))
+
+STYLE = ("--p_type=photon", "--arrow_type=forward", "--momentum_arrow=forward", "--momentum_label=k", "--v_style=dot")
+
+def parts(root, eid="p1"):
+    """Fingerprint of a path, and its linked elements as XML."""
+    elem = root.getElementById(eid)
+    fingerprint = dict(item.split(':') for item in elem.get(FeynmanLogic.FINGERPRINT_ATTRIBUTE).split(';'))
+    links = {attr: inkex.etree.tostring(root.getElementById(elem.get(attr)))
+             for attr in FeynmanLogic.LINK_ATTRIBUTES if elem.get(attr)}
+    return fingerprint, links
+
+def test_running_again_with_the_same_settings_changes_nothing(tmp_path):
+    first = run(tmp_path, document(straight("p1", 50)), *STYLE, ids=("p1",))
+    second = run(tmp_path, first, *STYLE, ids=("p1",))
+    assert second.tostring() == first.tostring()
+    assert set(parts(second)[1]) == set(FeynmanLogic.LINK_ATTRIBUTES)
+
+def test_only_the_changed_parts_are_redone(tmp_path):
+    first = run(tmp_path, document(straight("p1", 50)), *STYLE, ids=("p1",))
+    # Marks which only stay on the elements that are not drawn again
+    for attr in FeynmanLogic.LINK_ATTRIBUTES:
+        first.getElementById(first.getElementById("p1").get(attr)).set('data-kept', 'yes')
+    style = [arg.replace("momentum_label=k", "momentum_label=q") for arg in STYLE]
+    second = run(tmp_path, first, *style, ids=("p1",))
+    (old, _), (new, links) = parts(first), parts(second)
+    assert [part for part in new if new[part] != old[part]] == ["momentum"]
+    assert {attr for attr, xml in links.items() if b'data-kept' in xml} == {'data-feynman-ghost', 'data-feynman-vertices'}
+    assert second.getElementById(second.getElementById("p1").get('data-feynman-label')).text == "q"
+
+def test_deleted_parts_are_drawn_again(tmp_path):
+    first = run(tmp_path, document(straight("p1", 50)), *STYLE, ids=("p1",))
+    first.getElementById(first.getElementById("p1").get('data-feynman-label')).delete()
+    second = run(tmp_path, first, *STYLE, ids=("p1",))
+    label = second.getElementById(second.getElementById("p1").get('data-feynman-label'))
+    assert label is not None and label.text == "k"
+
+def test_moved_path_is_redone(tmp_path):
+    first = run(tmp_path, document(straight("p1", 50)), *STYLE, ids=("p1",))
+    elem = first.getElementById("p1")
+    elem.set(f"{{{NS_INK}}}original-d", "M 10,50 L 190,120")
+    elem.set('d', "M 10,50 L 190,120")
+    second = run(tmp_path, first, *STYLE, ids=("p1",))
+    (old, old_links), (new, new_links) = parts(first), parts(second)
+    assert all(new[part] != old[part] for part in ('vertex', 'arrow', 'momentum'))
+    assert new_links['data-feynman-ghost'] != old_links['data-feynman-ghost']
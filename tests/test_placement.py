@@ -0,0 +1,39 @@
+"""Invariants of the label placement (feynman_placement.py)."""
+import random
+
+from feynman_placement import BoxGrid, LabelPlacer, text_box, segment_box
+
+def overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def test_grid_finds_every_overlapping_box():
+    rng = random.Random(1)
+    grid, boxes = BoxGrid(), []
+    for _ in range(300):
+        x, y = rng.uniform(-200, 200), rng.uniform(-200, 200)
+        box = (x, y, x + rng.uniform(0.5, 60), y + rng.uniform(0.5, 60))
+        grid.insert(box)
+        boxes.append(box)
+    for _ in range(300):
+        x, y = rng.uniform(-220, 220), rng.uniform(-220, 220)
+        box = (x, y, x + rng.uniform(0.5, 30), y + rng.uniform(0.5, 30))
+        assert grid.collides(box) == any(overlaps(box, other) for other in boxes)
+
+def test_placed_labels_never_overlap_an_obstacle_when_a_free_place_exists():
+    rng = random.Random(2)
+    placer, registered = LabelPlacer(), []
+    for _ in range(80):
+        a = (rng.uniform(0, 300), rng.uniform(0, 300))
+        box = segment_box(a, (a[0] + rng.uniform(-40, 40), a[1] + rng.uniform(-40, 40)), 2.0)
+        placer.add_box(box)
+        registered.append(box)
+    for _ in range(200):
+        x, y = rng.uniform(0, 300), rng.uniform(0, 300)
+        boxes_at = lambda offset, shift: [text_box(x + shift, y + offset, 0.0, "p_1")]
+        free = any(not any(overlaps(box, other) for box in boxes_at(*candidate) for other in registered)
+                   for candidate in placer.candidates(8.0))
+        placed = boxes_at(*placer.place(boxes_at, 8.0))
+        if free:
+            assert not any(overlaps(box, other) for box in placed for other in registered)
+        # Placed labels are obstacles for the next ones
+        registered.extend(placed)
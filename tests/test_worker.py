@@ -0,0 +1,92 @@
+"""Protocol of the warm worker (feynman_worker.py)."""
+import os
+import json
+import time
+import socket
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+pytest.importorskip("inkex")
+
+import feynman_worker
+from feynman_worker import serve, stop, forward, connect, send_frame
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="needs Unix sockets")
+
+DOCUMENT = b"""<svg xmlns="http://www.w3.org/2000/svg" width="200" height="100">
+<path id="p1" d="M 10,50 L 190,50"/>
+</svg>"""
+
+@pytest.fixture
+def worker():
+    """Run a worker in a thread on a socket of its own. Yields (socket path, thread)."""
+    # Short private folder: socket paths are limited to about a hundred characters
+    folder = tempfile.mkdtemp(prefix="pf")
+    path = os.path.join(folder, "w.sock")
+    thread = threading.Thread(target=serve, args=(path,), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 60
+    while True:
+        sock = connect(path, timeout=1)
+        if sock is not None: break
+        assert thread.is_alive() and time.monotonic() < deadline, "the worker did not start"
+        time.sleep(0.05)
+    sock.close()
+    yield path, thread
+    if thread.is_alive():
+        stop(path)
+        thread.join(10)
+    shutil.rmtree(folder, ignore_errors=True)
+
+def test_stop_ends_the_worker(worker):
+    path, thread = worker
+    assert stop(path)
+    thread.join(10)
+    assert not thread.is_alive()
+    assert not os.path.exists(path)
+    assert not stop(path)
+
+def test_worker_stops_when_the_client_leaves_before_the_answer(worker):
+    path, thread = worker
+    for _ in range(5):
+        sock = connect(path)
+        with sock:
+            send_frame(sock, json.dumps({'command': 'stop'}).encode('utf-8'))
+        thread.join(10)
+        if not thread.is_alive(): break
+    assert not thread.is_alive()
+
+def test_forward_runs_the_extension_in_the_worker(worker, tmp_path):
+    path, _ = worker
+    document = tmp_path / "in.svg"
+    document.write_bytes(DOCUMENT)
+    status, stderr, output = forward(['--p_type=photon', '--id=p1', str(document)], path)
+    assert status == 0, stderr
+    assert b'data-feynman-fingerprint' in output
+    # The worker keeps serving after a request
+    sock = connect(path, timeout=1)
+    assert sock is not None
+    sock.close()
+
+def test_forward_gives_up_without_a_worker(tmp_path):
+    document = tmp_path / "in.svg"
+    document.write_bytes(DOCUMENT)
+    assert forward(['--id=p1', str(document)], str(tmp_path / "none.sock")) is None
+
+def test_forward_gives_up_on_a_stalled_worker(monkeypatch, tmp_path):
+    folder = tempfile.mkdtemp(prefix="pf")
+    path = os.path.join(folder, "s.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        listener.bind(path)
+        listener.listen(1)
+        monkeypatch.setattr(feynman_worker, 'TIMEOUT', 0.5)
+        document = tmp_path / "in.svg"
+        document.write_bytes(DOCUMENT)
+        assert forward(['--id=p1', str(document)], path) is None
+    finally:
+        listener.close()
+        shutil.rmtree(folder, ignore_errors=True)